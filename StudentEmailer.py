@@ -1,4 +1,6 @@
 import subprocess
+import hashlib
+import json
 import os
 
 ### GLOBALS DECLARATION; CHANGE TO CONF LATER ###
@@ -9,23 +11,85 @@ abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
 os.chdir(dname)
 
-# Check to make sure the proper environment exists
-envs = subprocess.run("conda env list", shell=True, capture_output=True, text=True).stdout
-if env_name not in envs:
-    resp = input(f"The conda environment this script is configured to use, {env_name} was not found (you can change the environment in the settings.conf file). Do you want to create it? (y/n)")
-    if "y" in resp:
-        # this currently creates an empty env; why?
-        subprocess.run(f"conda create --name {env_name}", shell=True)
-    else:
-        exit()
-
-pkgs = subprocess.run(f"conda list -n {env_name}", shell=True, capture_output=True, text=True).stdout
-for package in packages:
-    if package not in pkgs:
-        resp = input(f"{package} could not be found inside {env_name}. Do you want to install it it? (y/n)")
+# asking conda about environments and packages takes a few seconds each time, so once everything checks out we save
+# what we found here and skip asking next launch. It gets checked again whenever the environment name, the package
+# list or requirements.txt change, or anything gets installed into (or removed from) the environment, which is when
+# conda touches its conda-meta folder.
+env_check_file = "./userdata/env_check.json"
+
+def check_key():
+    requirements = b""
+    if os.path.exists("requirements.txt"):
+        with open("requirements.txt", "rb") as file:
+            requirements = file.read()
+    return {"env_name":env_name, "packages":packages, "requirements":hashlib.sha256(requirements).hexdigest()}
+
+def env_stamp(env_path):
+    try:
+        return os.stat(os.path.join(env_path, "conda-meta")).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+def cached_env_path():
+    try:
+        with open(env_check_file, "r") as file:
+            saved = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if saved.get("key") != check_key() or saved.get("stamp") is None or env_stamp(saved.get("env_path")) != saved["stamp"]:
+        return None
+    return saved["env_path"]
+
+def save_env_check(env_path):
+    os.makedirs(os.path.dirname(env_check_file), exist_ok=True)
+    with open(env_check_file, "w") as file:
+        json.dump({"key":check_key(), "env_path":env_path, "stamp":env_stamp(env_path)}, file, indent=4)
+
+# the folder conda keeps the environment in, out of `conda env list` (lines look like "name   *  /path/to/env")
+def find_env_path(envs):
+    for line in envs.splitlines():
+        parts = line.split()
+        if parts != [] and parts[0] == env_name:
+            return parts[-1]
+    return None
+
+# the original (slow) check: make sure the environment and packages exist, offering to create/install what's missing
+def probe_environment():
+    # Check to make sure the proper environment exists
+    envs = subprocess.run("conda env list", shell=True, capture_output=True, text=True).stdout
+    if find_env_path(envs) is None:
+        resp = input(f"The conda environment this script is configured to use, {env_name} was not found (you can change the environment in the settings.conf file). Do you want to create it? (y/n)")
         if "y" in resp:
-            subprocess.run(f"conda run -n {env_name} pip install {package}", shell=True)
+            # this currently creates an empty env; why?
+            subprocess.run(f"conda create --name {env_name}", shell=True)
+            envs = subprocess.run("conda env list", shell=True, capture_output=True, text=True).stdout
         else:
             exit()
 
-subprocess.run(f"conda run -n {env_name} python app.py", shell=True)
\ No newline at end of file
+    pkgs = subprocess.run(f"conda list -n {env_name}", shell=True, capture_output=True, text=True).stdout
+    for package in packages:
+        if package not in pkgs:
+            resp = input(f"{package} could not be found inside {env_name}. Do you want to install it it? (y/n)")
+            if "y" in resp:
+                subprocess.run(f"conda run -n {env_name} pip install {package}", shell=True)
+            else:
+                exit()
+    return find_env_path(envs)
+
+env_path = cached_env_path()
+if env_path is None:
+    env_path = probe_environment()
+    if env_path is not None:
+        save_env_check(env_path)
+
+# calling the environment's python directly skips the second or so `conda run` takes to get going
+python = None
+if env_path is not None:
+    for candidate in [os.path.join(env_path, "bin", "python"), os.path.join(env_path, "python.exe")]:
+        if os.path.exists(candidate):
+            python = candidate
+            break
+if python is not None:
+    subprocess.run([python, "app.py"])
+else:
+    subprocess.run(f"conda run -n {env_name} python app.py", shell=True)
@@ -0,0 +1,82 @@
+import numpy
+
+# class-level numbers for a module's report, the kind of thing that used to mean opening the export in a spreadsheet
+# and adding it up by hand. Everything comes off one students x assignments table of who's completed what (every
+# assignment due through the module, in the same order make_emails uses), so each number is a sum or mean down a
+# column or across a row instead of a loop over students.
+#
+# the summary CSV (see funcs.make_analytics) has a row per number, all shaped the same way so it can be sorted and
+# filtered like any other sheet:
+#
+#   section          name                          count                      total               rate
+#   course           everything due so far         completed (all students)   students x due      count/total
+#   module           the module's name             completed in the module    students x its size
+#   assignment       the assignment's name         students who did it        students
+#   actual_completed how many they've done (0..n)  students with that many    students
+#   at_risk          the student (and email)       their actual_completed     everything due
+#
+# a student is at risk when they've done less than ANALYTICS.at_risk_below (default 0.7) of what's been due so far.
+
+AT_RISK_BELOW = 0.7
+HEADER = ["section", "name", "count", "total", "rate"]
+
+
+# rows are the students in students.json order, columns the assignments (an assignment listed twice gets two columns,
+# like it counts twice in the report). True means they've done it, so it's everything not on api.json's missing lists.
+def completion_matrix(student_ids, api_dict, assignments) -> numpy.ndarray:
+    student_ids = numpy.asarray(student_ids, dtype=numpy.int64)
+    # sorted ids, so every missing list can be looked up with one searchsorted instead of a dict lookup per student
+    order = numpy.argsort(student_ids, kind="stable")
+    sorted_ids = student_ids[order]
+
+    completed = numpy.ones((len(student_ids), len(assignments)), dtype=bool)
+    if len(student_ids) == 0:
+        return completed
+    missing_rows = {}
+    for column, assignment in enumerate(assignments):
+        if assignment not in missing_rows:
+            missing = numpy.asarray(api_dict.get(assignment, []), dtype=numpy.int64)
+            found = numpy.searchsorted(sorted_ids, missing).clip(max=len(sorted_ids)-1)
+            # anybody on the list who isn't in students.json (dropped the class) doesn't count
+            missing_rows[assignment] = order[found[sorted_ids[found] == missing]]
+        completed[missing_rows[assignment], column] = False
+    return completed
+
+
+# the summary rows. modules is [(module name, how many of the columns are its assignments)], in column order. A module
+# named None gets no row of its own (its columns still count everywhere else).
+def summarize(completed, assignments, modules, students, at_risk_below=AT_RISK_BELOW) -> list:
+    student_count, due = completed.shape
+    rows = []
+
+    done_by_student = completed.sum(axis=1)
+    done_by_assignment = completed.sum(axis=0)
+    rows.append(["course", "everything due so far", int(done_by_student.sum()), student_count*due,
+                 rate(done_by_student.sum(), student_count*due)])
+
+    start = 0
+    for name, size in modules:
+        if name is not None:
+            done = int(done_by_assignment[start:start+size].sum())
+            rows.append(["module", name, done, student_count*size, rate(done, student_count*size)])
+        start += size
+
+    for assignment, done in zip(assignments, done_by_assignment.tolist()):
+        rows.append(["assignment", assignment, done, student_count, rate(done, student_count)])
+
+    for done, count in enumerate(numpy.bincount(done_by_student, minlength=due+1).tolist()):
+        rows.append(["actual_completed", done, count, student_count, rate(count, student_count)])
+
+    if due > 0:
+        at_risk = numpy.flatnonzero(done_by_student < at_risk_below*due)
+        # the furthest behind first
+        at_risk = at_risk[numpy.argsort(done_by_student[at_risk], kind="stable")]
+        for index in at_risk.tolist():
+            student = students[index]
+            done = int(done_by_student[index])
+            rows.append(["at_risk", f"{student['name']} ({student['email']})", done, due, rate(done, due)])
+    return rows
+
+
+def rate(count, total) -> str:
+    return f"{count/total:.3f}" if total else ""
@@ -1,9 +1,13 @@
+import os
 import streamlit as st
-from frontend_utils import run_button, week_number_input
+from frontend_utils import run_button, week_select, userdata, report
 import funcs
 
 st.title("Progress Report Emailer")
-tool_tab, config_tab = st.tabs(["Tools", "Config"])
+tool_tab, data_tab, config_tab = st.tabs(["Tools", "Data", "Config"])
+
+# Canvas syncs that finished less than this long ago get shown again instead of re-run when someone else presses Run
+SYNC_FRESH_FOR = 60
 
 with tool_tab:
     st.header("API Scraper")
@@ -11,36 +15,80 @@ with tool_tab:
     run_button(funcs.api_scrape, 
             key="api_scrape", 
             success_message="Scrape completed", 
-            error_message="Scrape failed")
+            error_message="Scrape failed",
+            fresh_for=SYNC_FRESH_FOR)
 
     st.header("Canvas API")
     st.write("This will scrape the assignments from Canvas using the API and save them to the userdata folder.")
-    week_for_api = week_number_input("api_week_input")
-    run_button(funcs.canvas_api, 
-            key="canvas_api", 
-            success_message="Scrape completed", 
-            error_message="Scrape failed", 
-            func_arg=week_for_api)
-
-    st.header("Validation")
-    st.write("This will check the consistency of the data in the userdata folder.")
-    run_button(
-        funcs.check, 
-        key="check", 
-        success_message="Check finished. See output below", 
-        error_message="Check failed"
-    )
+    week_for_api = week_select("api_week_input")
+    if week_for_api is not None:
+        run_button(funcs.canvas_api, 
+                key="canvas_api", 
+                success_message="Scrape completed", 
+                error_message="Scrape failed", 
+                func_arg=week_for_api,
+                fresh_for=SYNC_FRESH_FOR)
 
     st.header("Make Emails")
     st.write("This will make the emails for the assignments.")
-    week_for_emails = week_number_input("email_week_input")
-    run_button(funcs.make_emails, 
-            key="make_emails", 
-            success_message="Emails made", 
-            error_message="Emails failed", 
-            func_arg=week_for_emails
+    week_for_emails = week_select("email_week_input")
+    if week_for_emails is not None:
+        run_button(funcs.make_emails, 
+                key="make_emails", 
+                success_message="Emails made", 
+                error_message="Emails failed", 
+                func_arg=week_for_emails
+            )
+    st.write("Or make the emails for every module at once (up to the first one that hasn't been pulled yet).")
+    run_button(funcs.make_all_emails,
+            key="make_all_emails",
+            success_message="Emails made for every module",
+            error_message="Emails failed"
         )
 
+    st.header("Class Analytics")
+    st.write("This will add up the module's report for the whole class (completion rates per module and assignment, "
+             "how many students have done how much, and who's falling behind) and save it next to the report.")
+    week_for_analytics = week_select("analytics_week_input")
+    if week_for_analytics is not None:
+        run_button(funcs.make_analytics,
+                key="make_analytics",
+                success_message="Analytics made",
+                error_message="Analytics failed",
+                func_arg=week_for_analytics
+            )
+
+    st.header("Send Emails")
+    st.write("This will email every student their row of the report for the module, through the mail server in the "
+             "config. Anyone who already got this module's email is skipped.")
+    week_for_sending = week_select("send_week_input")
+    if week_for_sending is not None:
+        run_button(funcs.send_emails,
+                key="send_emails",
+                success_message="Emails sent",
+                error_message="Sending failed",
+                func_arg=week_for_sending
+            )
+
+
+with data_tab:
+    st.header("Modules")
+    modules = userdata("modules", {})
+    st.dataframe([{"Module":name, "Assignments":len(module["assignments"])} for name, module in modules.items()],
+                 hide_index=True, width="stretch")
+
+    st.header("Assignments")
+    assignments = userdata("assignments", {})
+    st.dataframe(list(assignments.values()), hide_index=True, width="stretch")
+
+    st.header("Reports")
+    exports = sorted(name for name in os.listdir("./exports") if name.endswith(".csv")) if os.path.exists("./exports") else []
+    if exports == []:
+        st.write("No reports made yet.")
+    else:
+        chosen = st.selectbox("Report", exports, key="report_select")
+        st.dataframe(report(os.path.join("./exports", chosen)), hide_index=True, width="stretch")
+
 
 with config_tab:
     st.header("Setup User Config")
@@ -53,4 +101,4 @@ with config_tab:
         success_message="Successfully created user config",
         error_message="Error during user config creation",
         func_arg=config_files
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,48 @@
+import contextlib
+import os
+
+# every file the tool saves goes through here: it's written under a temp name next to where it goes, and only swapped
+# in (os.replace, which can't leave half a file) once it's all there. If anything goes wrong first, the temp file gets
+# cleaned up and whatever was there before is left alone.
+#
+# temp names start with a . (and end in .tmp), so nothing that looks through a folder for its files (the Parquet
+# history, the exports list in the web app) ever picks one up.
+
+
+def temp_path(path) -> str:
+    return os.path.join(os.path.dirname(path), "."+os.path.basename(path)+".tmp")
+
+
+# several files written side by side (like every module's export in one pass): hands back the open temp files, and
+# moves them all into place only after every one of them has been written and closed
+@contextlib.contextmanager
+def open_all(paths, mode="w", **open_args):
+    temps = [temp_path(path) for path in paths]
+    files = []
+    try:
+        for path, temp in zip(paths, temps):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            files.append(open(temp, mode, **open_args))
+        yield files
+        for file in files:
+            file.close()
+        for temp, path in zip(temps, paths):
+            os.replace(temp, path)
+    except BaseException:
+        for file in files:
+            file.close()
+        for temp in temps:
+            if os.path.exists(temp):
+                os.remove(temp)
+        raise
+
+
+@contextlib.contextmanager
+def open_file(path, mode="w", **open_args):
+    with open_all([path], mode, **open_args) as files:
+        yield files[0]
+
+
+def write_bytes(path, data) -> None:
+    with open_file(path, "wb") as file:
+        file.write(data)
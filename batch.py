@@ -0,0 +1,126 @@
+import contextlib
+import copy
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import canvas_client
+import funcs
+
+# runs the whole weekly pipeline (roster, assignments, submissions, report) for every course listed under BATCH in
+# ./userdata/config.json, with the courses running side by side in separate processes.
+#
+# each course gets its own folder (BATCH.directory/<course>/) with its own userdata/ and exports/, laid out exactly
+# like the main ones, so you can still open a course's modules.json and fix its mapping by hand. The course's
+# config.json is made from the main one the first time; after that only its API section gets refreshed from the main
+# config, so per-course report tweaks stick.
+#
+# every process uses the same Canvas token, so they all draw from one shared rate limit (BATCH.requests_per_second).
+#
+# BATCH.courses is a list of course ids, or {"course": id, "week": module} to pin the module a course reports on.
+# Without a week, the report goes out for the latest module whose assignments have all come due.
+
+
+def run_batch(config=None) -> list:
+    if config is None:
+        config = funcs.get_config()
+    batch = config.get("BATCH", {})
+    courses = batch.get("courses", [])
+    if courses == []:
+        print("No courses listed under BATCH in ./userdata/config.json.")
+        return []
+
+    directory = os.path.abspath(batch.get("directory", "./courses"))
+    workers = max(1, min(int(batch.get("workers", 4)), len(courses)))
+    limit = canvas_client.SharedRateLimit(float(batch.get("requests_per_second", 10)))
+
+    started = time.time()
+    print(f"Running {len(courses)} courses, {workers} at a time...")
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(limit,)) as pool:
+        futures = [pool.submit(run_course, entry, config, directory) for entry in courses]
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            if result["status"] == "ok":
+                print(f"{result['course']}: reported on {result['week']} in {result['seconds']:.1f}s")
+            else:
+                print(f"{result['course']}: failed after {result['seconds']:.1f}s ({result['error']}), see {result['log']}")
+    print(f"All courses finished in {time.time()-started:.1f}s.")
+    return results
+
+
+# runs once in each worker process, before any courses
+def init_worker(limit) -> None:
+    funcs.shared_limit = limit
+
+
+# the whole pipeline for one course. Everything it prints goes to batch.log in the course's folder, since the
+# courses would just talk over each other otherwise.
+def run_course(entry, config, directory) -> dict:
+    if not isinstance(entry, dict):
+        entry = {"course":entry}
+    course = str(entry["course"])
+    course_dir = os.path.join(directory, course)
+    os.makedirs(course_dir, exist_ok=True)
+    os.chdir(course_dir)
+
+    started = time.time()
+    result = {"course":course, "week":None, "status":"ok", "log":os.path.join(course_dir, "batch.log")}
+    with open("batch.log", "w") as log, contextlib.redirect_stdout(log):
+        try:
+            prepare_course(course, config)
+            funcs.get_students()
+            funcs.api_scrape()
+            week = entry.get("week") or latest_due_week(funcs.get_week_data(), funcs.get_assignments(), time.time())
+            if week is None:
+                raise ValueError("no module has all of its assignments due yet")
+            result["week"] = week
+            # pull exactly what the report covers: this module and everything before it
+            week_map = funcs.get_week_data()
+            weeks = funcs.get_week_names()
+            assignments = []
+            for sent in weeks[:weeks.index(week)+1]:
+                assignments += week_map[sent]["assignments"]
+            funcs.pull_submissions(assignments)
+            funcs.make_emails(week)
+        except Exception as e:
+            traceback.print_exc(file=log)
+            result["status"] = "failed"
+            result["error"] = str(e) or type(e).__name__
+    result["seconds"] = time.time() - started
+    return result
+
+
+# sets up the course's userdata the same way Setup Userdata would, without wiping anything that's already there.
+def prepare_course(course, config) -> None:
+    funcs.setup_data([name for name in ["assignments", "modules", "api", "students"] if not funcs.store.exists(name)])
+
+    if funcs.store.exists("config"):
+        course_config = funcs.store.checkout("config")
+    else:
+        course_config = copy.deepcopy(config)
+        course_config.pop("BATCH", None)
+    course_config["API"] = copy.deepcopy(config["API"])
+    course_config["API"]["course"] = course
+    funcs.store.write("config", course_config)
+
+
+# the last module (in modules.json order) that has assignments and has had all of them come due by now
+def latest_due_week(week_map, assignment_dict, now):
+    latest = None
+    for week in week_map:
+        if week == "Homeless Assignments" or week_map[week]["assignments"] == []:
+            continue
+        due = [assignment_dict[assignment].get("duetimestamp", 0) for assignment in week_map[week]["assignments"]]
+        if max(due) <= now:
+            latest = week
+    return latest
+
+
+if __name__ == "__main__":
+    results = run_batch()
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
@@ -0,0 +1,197 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import canvas_client
+import funcs
+import synthetic_course
+
+# times the parts of the tool that grow with the size of the course, on made up courses (synthetic_course.py) at a few
+# sizes, so we know where things start to drag before bigger courses use it. No Canvas involved: every stage is timed
+# on the data Canvas would have handed back.
+#
+#   get_students  turning the enrollment list into students.json
+#   api_scrape    merging the assignment and module lists into what's saved (with the modules already mapped)
+#   canvas_api    decoding the submission pages and picking out who's missing, for every assignment
+#   make_emails   the whole report for the last module, from the userdata files to the export
+#
+# results are saved as JSON (./benchmark_results/<time>.json by default). Hand an older one to --compare to see what
+# got faster or slower.
+#
+#   python3 benchmark.py --students 1000,5000,20000 --assignments 60 --modules 12 --repeat 3
+
+STAGES = ["get_students", "api_scrape", "canvas_api", "make_emails"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time the tool on synthetic courses.")
+    parser.add_argument("--students", default="1000,5000,20000", help="comma separated course sizes to run")
+    parser.add_argument("--assignments", type=int, default=60)
+    parser.add_argument("--modules", type=int, default=12)
+    parser.add_argument("--missing-rate", type=float, default=0.15)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="where to save the results")
+    parser.add_argument("--compare", default=None, help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = {"started":time.strftime("%Y-%m-%dT%H:%M:%S"), "python":sys.version.split()[0], "platform":platform.platform(),
+               "commit":git_commit(), "repeat":args.repeat, "runs":[]}
+    for students in [int(size) for size in args.students.split(",")]:
+        print(f"{students} students, {args.assignments} assignments, {args.modules} modules...")
+        run = run_scale(students, args.assignments, args.modules, args.missing_rate, args.seed, args.repeat)
+        results["runs"].append(run)
+        for stage in STAGES:
+            best = run["stages"][stage]["best"]
+            print(f"    {stage:<14}{best:9.3f}s  ({best/students*1e6:8.1f}us per student)")
+
+    output = args.output or os.path.join("benchmark_results", time.strftime("%Y%m%d-%H%M%S")+".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+    print("Results saved to", os.path.abspath(output))
+
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            compare(json.load(file), results)
+
+
+# builds one course and times every stage on it. Each stage gets fresh copies of its inputs, and the copying isn't timed.
+def run_scale(students, assignments, modules, missing_rate, seed, repeat) -> dict:
+    course = synthetic_course.make_course(students, assignments, modules, missing_rate, seed)
+    run = {"students":students, "assignments":assignments, "modules":modules, "missing_rate":missing_rate, "seed":seed,
+           "stages":{}}
+
+    # make_emails (and the saved assignments/modules api_scrape merges into) need a real userdata folder, so work out of
+    # a scratch directory the same way the batch runner works out of a course folder
+    home = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        os.chdir(scratch)
+        funcs.store.forget()
+        with contextlib.redirect_stdout(io.StringIO()):
+            synthetic_course.write_userdata(course)
+        saved_assignments = funcs.store.checkout("assignments")
+        saved_modules = funcs.store.checkout("modules")
+        week = [module for module in funcs.get_week_names() if module != "Homeless Assignments"][-1]
+
+        run["stages"]["get_students"] = timed(repeat, lambda: None,
+            lambda _: funcs.students_from_enrollments(course["enrollments"], course["sections"]))
+
+        # modules come with their items, like api_scrape asks for them
+        new_modules = [dict(module, items=synthetic_course.module_items(course, module)) for module in course["modules"]]
+        run["stages"]["api_scrape"] = timed(repeat, lambda: (copy.deepcopy(saved_assignments), copy.deepcopy(saved_modules),
+                                                             new_modules),
+            lambda saved: merge_all(saved, course))
+
+        run["stages"]["canvas_api"] = time_canvas_api(course, saved_assignments, repeat)
+
+        def cold():
+            # start from the files, like a fresh run of the tool would
+            funcs.store.forget()
+            for name in os.listdir("exports"):
+                os.remove(os.path.join("exports", name))
+
+        def report(_):
+            with contextlib.redirect_stdout(io.StringIO()):
+                funcs.make_emails(week)
+        run["stages"]["make_emails"] = timed(repeat, cold, report)
+    finally:
+        os.chdir(home)
+        funcs.store.forget()
+        shutil.rmtree(scratch, ignore_errors=True)
+    return run
+
+
+def merge_all(saved, course) -> None:
+    assignments, modules, new_modules = saved
+    export = funcs.merge_assignments(assignments, course["assignments"])
+    funcs.merge_modules(modules, new_modules, list(export.keys()), funcs.module_item_index(course["assignments"]))
+
+
+# Canvas sends submissions 100 to a page. The pages are made up (untimed) one assignment at a time so the biggest
+# courses don't need every submission in memory at once. They're decoded the way a lean pull reads them
+# (canvas_client.read_records), as if they came down in network sized pieces.
+def time_canvas_api(course, saved_assignments, repeat) -> dict:
+    runs = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        for assignment in course["assignments"]:
+            submissions = synthetic_course.make_submissions(course, assignment)
+            pages = [json.dumps(submissions[start:start+100]).encode() for start in range(0, len(submissions), 100)]
+            missingif = saved_assignments[assignment["name"]]["missingif"]
+            started = time.perf_counter()
+            missing = []
+            for page in pages:
+                records = canvas_client.read_records(SavedPage(page), funcs.SUBMISSION_FIELDS, "benchmark page")
+                missing += funcs.missing_from_submissions(records, missingif)
+            elapsed += time.perf_counter() - started
+        runs.append(elapsed)
+    return summarize(runs)
+
+
+# just enough of a streamed requests response for read_records
+class SavedPage:
+
+    def __init__(self, body):
+        self.body = body
+        self.encoding = "utf-8"
+        self.url = "benchmark"
+
+    def iter_content(self, chunk_size):
+        return (self.body[start:start+chunk_size] for start in range(0, len(self.body), chunk_size))
+
+    def close(self) -> None:
+        pass
+
+
+# runs setup (untimed) then stage(setup's result), repeat times
+def timed(repeat, setup, stage) -> dict:
+    runs = []
+    for _ in range(repeat):
+        prepared = setup()
+        started = time.perf_counter()
+        stage(prepared)
+        runs.append(time.perf_counter() - started)
+    return summarize(runs)
+
+
+def summarize(runs) -> dict:
+    return {"best":min(runs), "median":statistics.median(runs), "runs":runs}
+
+
+def compare(before, after) -> None:
+    print(f"Compared to {before.get('started')} ({before.get('commit')}):")
+    old_runs = {(run["students"], run["assignments"], run["modules"]): run for run in before["runs"]}
+    for run in after["runs"]:
+        old = old_runs.get((run["students"], run["assignments"], run["modules"]))
+        if old is None:
+            print(f"    {run['students']} students: not in the older results")
+            continue
+        for stage in STAGES:
+            if stage not in old["stages"]:
+                continue
+            then, now = old["stages"][stage]["best"], run["stages"][stage]["best"]
+            print(f"    {run['students']:>6} students {stage:<14}{then:9.3f}s -> {now:9.3f}s  ({now/then:5.2f}x)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import codecs
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import sync_metrics
+
+# one place for everything that talks to Canvas. Every call in funcs used to build its own url with the token in the
+# query string, open a brand new connection, and sleep a fixed few seconds whenever Canvas pushed back. The client
+# keeps a pooled keep-alive session, sends the token as a header, and paces itself off of Canvas's rate limit headers.
+
+# how much of a streamed response to read at a time (see read_records)
+READ_CHUNK = 64*1024
+# what can come between the items of a JSON list
+SEPARATORS = re.compile(r"[ \t\r\n,]*")
+
+
+class CanvasAPIError(Exception):
+    pass
+
+
+# Canvas gives every token a bucket that drains as requests come in and refills over time. Each response tells us how
+# much is left (X-Rate-Limit-Remaining), and throttled responses may say how long to wait (Retry-After). This is shared
+# by every thread using the client, so when one request gets throttled everyone else holds off too.
+class Throttler:
+
+    def __init__(self, low_water=150.0, max_pace=1.0, base_delay=0.5, max_delay=30.0, stale_after=10.0, shared=None):
+        # below low_water remaining, we start spacing requests out, up to max_pace seconds apart as it hits zero
+        self.low_water = low_water
+        self.max_pace = max_pace
+        # backoff after a throttled response grows exponentially from base_delay, capped at max_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # the bucket refills on its own, so a reading we haven't refreshed in a while doesn't mean much anymore
+        self.stale_after = stale_after
+
+        # a SharedRateLimit when several processes are hitting Canvas with the same token (see batch.py)
+        self.shared = shared
+
+        self.remaining = None
+        self.updated = 0.0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    # called right before a request goes out.
+    def wait(self) -> None:
+        with self.lock:
+            delay = self.paused_until - time.monotonic()
+            fresh = time.monotonic() - self.updated < self.stale_after
+            if fresh and self.remaining is not None and self.remaining < self.low_water:
+                # the closer we get to empty, the longer we wait. jitter keeps the threads from lining back up.
+                pace = self.max_pace * (1 - max(self.remaining, 0) / self.low_water)
+                delay = max(delay, random.uniform(pace / 2, pace))
+        if delay > 0:
+            time.sleep(delay)
+        if self.shared is not None:
+            self.shared.acquire()
+
+    # called with every response we get back.
+    def update(self, r) -> None:
+        remaining = r.headers.get("X-Rate-Limit-Remaining")
+        if remaining is not None:
+            try:
+                with self.lock:
+                    self.remaining = float(remaining)
+                    self.updated = time.monotonic()
+            except ValueError:
+                pass
+
+    # called when a response was throttled. Returns how long this thread will wait before retrying, and makes
+    # everyone else wait that long too.
+    def backoff(self, attempt, r=None) -> float:
+        delay = None
+        if r is not None and r.headers.get("Retry-After") is not None:
+            try:
+                delay = float(r.headers["Retry-After"])
+            except ValueError:
+                delay = None
+        if delay is None:
+            # "full jitter": a random wait somewhere under the exponential ceiling
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        if self.shared is not None:
+            self.shared.pause(delay)
+        return delay
+
+
+# a token bucket that lives in shared memory, so every process in a pool draws from the same limit. Hand it to the
+# worker processes when they start (it can't be pickled after that). A throttled response in any process pauses all
+# of them.
+class SharedRateLimit:
+
+    def __init__(self, rate, burst=None):
+        # rate is requests per second, burst is how many can go out back to back after a quiet spell
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(1.0, self.rate)
+        self.lock = multiprocessing.Lock()
+        self.tokens = multiprocessing.Value("d", self.burst, lock=False)
+        self.stamp = multiprocessing.Value("d", time.time(), lock=False)
+        self.paused_until = multiprocessing.Value("d", 0.0, lock=False)
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.paused_until.value > now:
+                    delay = self.paused_until.value - now
+                else:
+                    self.tokens.value = min(self.burst, self.tokens.value + (now - self.stamp.value) * self.rate)
+                    self.stamp.value = now
+                    if self.tokens.value >= 1:
+                        self.tokens.value -= 1
+                        return
+                    delay = (1 - self.tokens.value) / self.rate
+            time.sleep(delay)
+
+    def pause(self, delay) -> None:
+        with self.lock:
+            self.paused_until.value = max(self.paused_until.value, time.time() + delay)
+
+
+class CanvasClient:
+
+    def __init__(self, base_url, apikey, pool_size=10, max_retries=6, throttler=None, cache=None):
+        if not base_url.endswith("/"):
+            base_url += "/"
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.throttler = throttler if throttler is not None else Throttler()
+        # an http_cache.ResponseCache, used by requests made with cached=True
+        self.cache = cache
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = "Bearer "+apikey
+        # keep enough connections around for every thread we might be running at once
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # accepts either a path under the api root ("courses/123/users") or a full url (like a Link header gives us)
+    def url(self, path) -> str:
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return self.base_url+path.lstrip("/")
+
+    # a single GET, retried when Canvas throttles us or has a hiccup. Gives up after max_retries.
+    # cached=True makes the request conditional on whatever the response cache has saved for it.
+    # stream=True hands the response back before the body's been read, for read_records (it can't be combined with cached).
+    def get(self, path, params=None, headers=None, label=None, cached=False, stream=False):
+        url = self.url(path)
+        label = label if label is not None else url
+
+        key = None
+        if cached and self.cache is not None:
+            key = self.cache.key(url, params)
+            headers = dict(headers) if headers is not None else {}
+            headers.update(self.cache.conditional_headers(key))
+
+        attempt = 0
+        while True:
+            # every attempt gets timed for sync_metrics, along with how long the throttler held it back
+            waiting = time.monotonic()
+            self.throttler.wait()
+            started = time.monotonic()
+            try:
+                r = self.session.get(url, params=params, headers=headers, stream=stream)
+            except requests.ConnectionError as e:
+                sync_metrics.request(url, time.monotonic()-started, None, 0, started-waiting)
+                r = None
+                error = e
+            else:
+                # a streamed body hasn't come down yet, so its size gets counted as it's read (see read_records)
+                size = 0 if stream and r.status_code < 300 else len(r.content)
+                sync_metrics.request(url, time.monotonic()-started, r.status_code, size, started-waiting)
+                self.throttler.update(r)
+                if not is_throttled(r) and r.status_code < 500:
+                    if r.status_code >= 400:
+                        raise CanvasAPIError(f"{r.status_code} from Canvas for {label}: {r.text[:200]}")
+                    if key is not None and r.status_code == 304:
+                        saved = self.cache.hit(key, url)
+                        if saved is not None:
+                            sync_metrics.advance(label)
+                            return saved
+                        # we lost the saved copy somehow, so just ask for the whole thing
+                        return self.get(path, params=params, label=label)
+                    if key is not None:
+                        self.cache.store(key, url, r)
+                    sync_metrics.advance(label)
+                    return r
+                error = f"status code {r.status_code}"
+
+            if attempt >= self.max_retries:
+                raise CanvasAPIError(f"Gave up on {label} after {attempt+1} tries ({error})")
+            sync_metrics.retry(url, r is not None and is_throttled(r))
+            delay = self.throttler.backoff(attempt, r)
+            print(f"Canvas pushed back on {label} ({error}), retrying in {delay:.1f}s...")
+            attempt += 1
+
+    def get_json(self, path, params=None, label=None, cached=False):
+        return self.get(path, params=params, label=label, cached=cached).json()
+
+    # pulls every page of a list endpoint. Canvas puts the next page in the Link header (some endpoints, like enrollments,
+    # use opaque bookmarks instead of page numbers), so we follow that until it runs out.
+    def get_pages(self, path, params=None, label=None, cached=False) -> list:
+        label = label if label is not None else path
+        results = []
+        url = path
+        page = 1
+        while url is not None:
+            print(f"Requesting page {page} of {label}...")
+            # we only find out about the next page once we have this one
+            sync_metrics.plan(1)
+            r = self.get(url, params=params, label=f"page {page} of {label}", cached=cached)
+            results += r.json()
+            # the next link already carries the page and filters
+            url = r.links.get("next", {}).get("url")
+            params = None
+            page += 1
+        return results
+
+    # one page of a list endpoint, read a piece at a time and boiled down to just the fields asked for as it goes.
+    # Hands back (records, response) so the caller can still get at the Link header.
+    def get_records(self, path, params, fields, label=None):
+        r = self.get(path, params=params, label=label, stream=True)
+        return read_records(r, fields, label if label is not None else path), r
+
+    # get_pages, but each page goes through get_records
+    def get_record_pages(self, path, params, fields, label=None) -> list:
+        label = label if label is not None else path
+        results = []
+        url = path
+        page = 1
+        while url is not None:
+            print(f"Requesting page {page} of {label}...")
+            sync_metrics.plan(1)
+            records, r = self.get_records(url, params, fields, label=f"page {page} of {label}")
+            results += records
+            url = r.links.get("next", {}).get("url")
+            params = None
+            page += 1
+        return results
+
+    def close(self) -> None:
+        self.session.close()
+
+
+# Canvas answers an over-eager client with a 403 "Rate Limit Exceeded" (and some proxies use 429). A 403 for anything
+# else (bad token, no access) is a real error and retrying won't fix it.
+def is_throttled(r) -> bool:
+    if r.status_code == 429:
+        return True
+    if r.status_code == 403:
+        if "rate limit exceeded" in r.text.lower():
+            return True
+        remaining = r.headers.get("X-Rate-Limit-Remaining")
+        try:
+            return remaining is not None and float(remaining) <= 0
+        except ValueError:
+            return False
+    return False
+
+
+# decodes a streamed JSON list one item at a time as the body comes in, keeping only the given fields of each item
+# (missing ones come out as None). Neither the whole body nor the full items ever sit in memory at once, which matters
+# for pages where most of every item is stuff we don't use.
+def read_records(r, fields, label) -> list:
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(r.encoding or "utf-8")(errors="replace")
+    records = []
+    buffer = ""
+    position = 0
+    state = "start"
+    size = 0
+    try:
+        for chunk in r.iter_content(chunk_size=READ_CHUNK):
+            size += len(chunk)
+            buffer = buffer[position:] + text.decode(chunk)
+            position = 0
+            while state != "done":
+                # skip to the next item (past the [ that opens the list, or the comma after the last item)
+                position = SEPARATORS.match(buffer, position).end()
+                if position >= len(buffer):
+                    break
+                if state == "start":
+                    if buffer[position] != "[":
+                        raise CanvasAPIError(f"Expected a list from Canvas for {label}, got {buffer[position:position+100]!r}")
+                    state = "items"
+                    position += 1
+                    continue
+                if buffer[position] == "]":
+                    state = "done"
+                    break
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the rest of this item hasn't come down yet
+                    break
+                records.append({field: item.get(field) for field in fields})
+    finally:
+        r.close()
+        sync_metrics.received(r.url, size)
+    if state != "done":
+        raise CanvasAPIError(f"The list Canvas sent for {label} got cut off or isn't valid JSON")
+    return records
+
+
+# reads the last page number out of a response's Link header, if Canvas gave us one.
+def last_page(r):
+    if "last" in r.links:
+        match = re.search(r"[?&]page=([0-9]+)", r.links["last"]["url"])
+        if match:
+            return int(match.group(1))
+    return None
@@ -0,0 +1,133 @@
+import difflib
+import os
+import re
+import time
+
+import atomic
+
+# the email template: a TITLE: line with the subject, then BODY: and the body, with {{Column Name}} wherever a column
+# of the report goes (see examples/sample_email.txt). The column names have to be the fieldnames from
+# config['REPORT']['include'].
+#
+# a template gets parsed once into a list of pieces, literal text and column names taking turns, and checked against
+# the report's columns before anything gets rendered. bind() then points each name at its spot in the report's rows,
+# so rendering a student is filling a handful of slots and joining, no searching or replacing per student.
+
+PLACEHOLDER = re.compile(r"\{\{(.*?)\}\}")
+
+
+class Template:
+
+    def __init__(self, subject, body, path="the email template"):
+        self.path = path
+        # splitting on the placeholder leaves the literal text at the even positions and the names at the odd ones
+        self.subject = [piece if index % 2 == 0 else piece.strip() for index, piece in enumerate(PLACEHOLDER.split(subject))]
+        self.body = [piece if index % 2 == 0 else piece.strip() for index, piece in enumerate(PLACEHOLDER.split(body))]
+
+    # every column the template uses, in the order they first show up
+    def fields(self) -> list:
+        return list(dict.fromkeys(self.subject[1::2] + self.body[1::2]))
+
+    # complains about every {{...}} that isn't one of field_names, with a guess at what was meant
+    def validate(self, field_names) -> None:
+        problems = []
+        for name in self.fields():
+            if name not in field_names:
+                guess = difflib.get_close_matches(name, field_names, n=1)
+                problems.append("{{"+name+"}}" + (f" (did you mean {{{{{guess[0]}}}}}?)" if guess else ""))
+        if problems != []:
+            raise ValueError(f"{self.path} uses {', '.join(problems)}, which "
+                             f"{'is' if len(problems) == 1 else 'are'}n't in the report. The columns are: "
+                             f"{', '.join(field_names)}.")
+
+    # ties the template to the report's header row, for rendering the rows under it (plain lists, like csv.reader's)
+    def bind(self, header):
+        self.validate(header)
+        return Renderer(self, header)
+
+
+class Renderer:
+
+    def __init__(self, template, header):
+        # a column that shows up twice in the header uses the first one, like a dict row would
+        columns = {}
+        for index, name in enumerate(header):
+            columns.setdefault(name, index)
+        self.subject_parts, self.subject_slots = compile_pieces(template.subject, columns)
+        self.body_parts, self.body_slots = compile_pieces(template.body, columns)
+
+    def subject(self, row) -> str:
+        # a line break in a header would end it early
+        return fill(self.subject_parts, self.subject_slots, row).replace("\r", " ").replace("\n", " ")
+
+    def body(self, row) -> str:
+        return fill(self.body_parts, self.body_slots, row)
+
+
+# the pieces with blanks where the columns go, and (position, column) for each blank
+def compile_pieces(pieces, columns) -> tuple:
+    parts = list(pieces)
+    slots = []
+    for position in range(1, len(pieces), 2):
+        parts[position] = ""
+        slots.append((position, columns[pieces[position]]))
+    return parts, slots
+
+
+def fill(parts, slots, row) -> str:
+    if slots == []:
+        return parts[0]
+    parts = parts.copy()
+    for position, column in slots:
+        parts[position] = row[column]
+    return "".join(parts)
+
+
+def load(path) -> Template:
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No email template at {path}. Copy examples/sample_email.txt there (or point "
+                                f"EMAIL.template at yours) and make the {{{{...}}}} names match the report's columns.")
+    with open(path, "r", encoding="utf-8") as file:
+        text = file.read()
+    if "BODY:" not in text:
+        raise ValueError(f"{path} needs a BODY: line before the email body (and a TITLE: line for the subject).")
+    title, body = text.split("BODY:", 1)
+    return Template(title.replace("TITLE:", "", 1).strip(), body.lstrip("\r\n"), path)
+
+
+# one .eml file per (to, message bytes) in messages, numbered in report order. The bytes should come from
+# mailer.build_message(...).as_bytes(), so the files are exactly what would get sent. Old .eml files in the folder get
+# cleared out first so a smaller class doesn't leave extras behind.
+def write_eml(directory, messages) -> int:
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".eml"):
+            os.remove(os.path.join(directory, name))
+    count = 0
+    for to, data in messages:
+        count += 1
+        with open(os.path.join(directory, f"{count:05d} {safe_name(to)}.eml"), "wb") as file:
+            file.write(data)
+    return count
+
+
+# every message in one mbox file (mboxrd: body lines starting with "From " get a > so they aren't read as a new
+# message), written to a temp file and swapped in at the end
+FROM_LINE = re.compile(rb"^(>*From )", re.MULTILINE)
+
+def write_mbox(path, messages) -> int:
+    separator = f"From MAILER-DAEMON {time.asctime()}\n".encode()
+    count = 0
+    with atomic.open_file(path, "wb") as file:
+        for to, data in messages:
+            count += 1
+            file.write(separator)
+            file.write(FROM_LINE.sub(rb">\1", data) if b"From " in data else data)
+            if not data.endswith(b"\n"):
+                file.write(b"\n")
+            file.write(b"\n")
+    return count
+
+
+def safe_name(text) -> str:
+    return re.sub(r"[^A-Za-z0-9@._+-]", "_", text)
@@ -1,28 +1,91 @@
 import streamlit as st
-import io
-import contextlib
+import os
+import time
+import pandas
+import funcs
+import jobs
 
-def run_button(func, key, success_message, error_message, func_arg = None):
+# what a job's progress is counted in, if it isn't Canvas requests
+PROGRESS_UNITS = {"send_emails":"emails"}
+
+# runs func in the background when the button is pressed (see jobs.py), and shows how it's going: a progress bar
+# (counted in Canvas requests, see sync_metrics) and the tail of its output while it runs, then how it went. Jobs are
+# shared by everyone using the app, so pressing Run on something already running just follows along with it, and
+# anything that finished less than fresh_for seconds ago gets shown instead of being run again.
+def run_button(func, key, success_message, error_message, func_arg = None, fresh_for = 0):
+    job_key = key if func_arg is None else f"{key}:{func_arg}"
     if st.button("Run", width="stretch", key=key):
-        buf = io.StringIO()
-        try:
-            with contextlib.redirect_stdout(buf):
-                if func_arg is not None:
-                    func(func_arg)
-                else:
-                    func()
-            st.success(success_message)
-        except Exception as e:
-            st.error(f"{error_message}: {e}")
-        if buf.getvalue().strip() != "":
-            st.code(buf.getvalue(), language="text")
-
-
-def week_number_input(key):
-    return st.number_input(
-        "Enter Week/Module number to retrieve (e.g. 2.1)",  
-        key=key,
-        min_value=0.0, 
-        step=0.1,
-        format="%0.1f"
-    )
+        args = () if func_arg is None else (func_arg,)
+        job, started = jobs.submit(job_key, key, func, *args, fresh_for=fresh_for)
+        if not started and job.running():
+            st.info("This is already running (someone else started it), following along with that run.")
+        elif not started:
+            st.info(f"This just finished {time.time()-job.finished:.0f}s ago, showing that run instead of starting another.")
+    job = jobs.latest(job_key)
+    if job is not None:
+        job_status(job, success_message, error_message)
+
+
+def job_status(job, success_message, error_message):
+    was_running = job.running()
+
+    # only this part of the page reruns (every second, while the job's going)
+    @st.fragment(run_every=1.0 if was_running else None)
+    def show():
+        if job.running():
+            if job.total > 0:
+                st.progress(min(1.0, job.done/job.total), text=f"{job.done} of {job.total} {PROGRESS_UNITS.get(job.name, 'Canvas requests')}")
+            else:
+                st.progress(0.0, text="Working...")
+            log = job.log.text(last=20)
+            if log.strip() != "":
+                st.code(log, language="text")
+            return
+        if was_running:
+            # rerun the whole page so everything reading userdata picks up what the job saved
+            st.rerun()
+
+        finished = time.strftime("%H:%M:%S", time.localtime(job.finished))
+        if job.status == "failed":
+            st.error(f"{error_message}: {job.error} (at {finished})")
+        else:
+            st.success(f"{success_message} (at {finished})")
+        if job.metrics is not None and job.metrics.summary()["totals"]["requests"] > 0:
+            st.caption(job.metrics.describe())
+        log = job.log.text()
+        if log.strip() != "":
+            with st.expander("Output"):
+                st.code(log, language="text")
+    show()
+
+
+# userdata for showing on the page. Streamlit reruns the whole script on every click, so this keeps the parsed copy
+# around until the data itself changes (the store's fingerprint), no matter who or what changed it.
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_userdata(name, fingerprint):
+    return funcs.store.read(name)
+
+def userdata(name, default=None):
+    fingerprint = funcs.store.fingerprint(name)
+    if fingerprint is None:
+        return default
+    return cached_userdata(name, fingerprint)
+
+
+# same idea for the reports in ./exports, keyed on the file's modified time and size
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_report(path, fingerprint):
+    return pandas.read_csv(path)
+
+def report(path):
+    stat = os.stat(path)
+    return cached_report(path, (stat.st_mtime_ns, stat.st_size))
+
+
+def week_select(key):
+    # Homeless Assignments is just what's left over, not something to report on
+    weeks = [week for week in userdata("modules", {}) if week != "Homeless Assignments"]
+    if weeks == []:
+        st.info("No modules yet, pull the course's assignments first.")
+        return None
+    return st.selectbox("Module to report on", weeks, index=len(weeks)-1, key=key)
@@ -1,11 +1,33 @@
 import os
+import bisect
 import csv
 import json
-import requests
+import threading
 import datetime
-import time
+import hashlib
 import re
 import sys
+import atomic
+import report_fields
+import sync_metrics
+import jobs
+from userdata_store import store
+from concurrent.futures import ThreadPoolExecutor
+
+# how many assignment IDs we put in a single bulk submissions query
+BULK_ASSIGNMENT_CHUNK = 50
+
+# how far (in seconds) incremental syncs back up their cursor, to cover clock differences between us and Canvas
+SYNC_OVERLAP = 300
+
+# canvas_client (and with it requests) and http_cache only get imported once something actually talks to Canvas, so
+# the menu and the Streamlit app don't wait on them just to start up.
+
+# shared Canvas clients, see get_client()
+clients = {}
+client_lock = threading.Lock()
+# set by the batch runner so every course's process shares one rate limit (a canvas_client.SharedRateLimit)
+shared_limit = None
 
 # logic that sets working directory to current. required for runtime on linux
 abspath = os.path.abspath(__file__)
@@ -17,17 +39,7 @@ os.chdir(dname)
 # and I think we should migrate to just using the api for everything. We can leave the old functionality in here under
 # some legacy code (could help in working with non-Canvas systems in the future), but right now the entire scope of this
 # project exists in Canvas.
-def canvas_api(current_week) -> None:
-    
-    config = get_config()
-
-    # a lot of this config reading (which we may add more) can eventually be put somewhere less scoped
-    apikey = config["API"]["apikey"]
-    course = config["API"]["course"]
-
-    # right now we determine what assignments to pull based on the "./userdata/assignments.json" file. If a given assignment has
-    # the api listed as its submission criterion, it pulls it here. Otherwise, we ignore it.
-    assignment_dict = get_assignments()
+def canvas_api(current_week, incremental=None) -> None:
 
     # this scopes the API usage so that we're not pulling everything in the class all at once. I'll be so real;
     # we can pull everything all at once. It's not that much of a problem.    
@@ -45,63 +57,394 @@ def canvas_api(current_week) -> None:
     for week in weeks_to_send:
         current_assignments += week_map[week]["assignments"]
 
-    # start of the actual code. missing_dict is the actual api dump that we save
-    missing_dict = {}
-    for assignment in set(current_assignments):
-            
-        # canvas gradebook (and subsequently our code) embeds assignments as "name (assignment_id)". This strips the assignment ID.
-        # if we change this in the future, would make sense to fix this.
-        assignment_id = str(assignment_dict[assignment]["id"])
-        # for each assignment that needs api info we create a list.
-        missing_dict[assignment] = []
+    pull_submissions(current_assignments, incremental)
 
-        # so fun fact; we have to batch requests per 100 students to the API. This  looping function is here to go over all the pages.
-        # maybe eventually we implement a progress bar or something? We can know the total amount of work ahead of time.
-        page = 1
-        print(f"Requesting page {page} of {assignment}...")
-        # below is the full api url for the dump. You can look it over, it's pretty straightforward.
-        base = "https://uncc.instructure.com/api/v1/courses/"+course+"/assignments/"
-        query = assignment_id+"/submissions?access_token="+apikey+"&per_page=100&page=1&include[]=submission_history"
-        r = requests.get(base+query)
-        # sometimes Canvas will get mad at the number of requests, depending on the speokay,ed of the data transfer. This catches that issue and sleeps
-        # the thread long enough to let us try again.
-        while r.status_code == 403 or list(json.loads(r.text))[0] == "errors":
-            print(f"Status Code 403, rerequesting page {page} of {assignment}...")
-            time.sleep(5)
-            r = requests.get(base+query)
-
-        while r.text != "[]":
-            page += 1
-            submissions = json.loads(r.text)
-            for submission in submissions:
-                if type(assignment_dict[assignment]["missingif"]) != type([]):
-                    assignment_dict[assignment]["missingif"] = [assignment_dict[assignment]["missingif"]]
-                for criterion in assignment_dict[assignment]["missingif"]:
-                # canvas just directly holds a boolean called missing for submittable assignments. freakin sweet
-                    if submission["missing"] and criterion == "api":
-                        # the way that we store missing assignments is a list of user IDs we cross-reference later. seemed okay to me
-                        missing_dict[assignment].append(submission["user_id"])
-                    # handles 0 case for now  
-                    elif submission["grade"] == criterion:
-                        missing_dict[assignment].append(submission["user_id"])
-
-            # all the code from above again. a dowhile in python would go crazy... which we can write.
-            print(f"Requesting page {page} of {assignment}...")
-            query = assignment_id+"/submissions?access_token="+apikey+"&per_page=100&page="+str(page)+"&include[]=submission_history"
-            r = requests.get(base+query)
-            while r.status_code == 403 or (r.text != "[]" and list(json.loads(r.text))[0] == "errors"):
-                print(f"Status Code 403, rerequesting page {page} of {assignment}...")
-                time.sleep(5)
-                r = requests.get(base+query)
-            print("Done!")
-        # empty page, so we're done with this assignment
-        print(f"Page {page} empty, moving on...")
 
-    
+# pulls the submission status of the given assignments and saves it to api.json. canvas_api picks the assignments
+# from the module list; anything else that already knows which assignments it needs (like the batch runner) can
+# call this directly.
+@sync_metrics.tracked("pull_submissions")
+def pull_submissions(current_assignments, incremental=None) -> None:
+
+    config = get_config()
+
+    # incremental runs only ask Canvas for what changed since the last pull. The config sets the default.
+    if incremental is None:
+        incremental = config["API"].get("incremental", False)
+    # we save when this run started (not ended) as the cursor, so nothing that changes mid-pull slips through
+    started = datetime.datetime.now(datetime.timezone.utc)
+
+    # right now we determine what assignments to pull based on the "./userdata/assignments.json" file. If a given assignment has
+    # the api listed as its submission criterion, it pulls it here. Otherwise, we ignore it.
+    assignment_dict = get_assignments()
+
+    sync_state = store.checkout("sync_state", {})
+    # what Canvas says right now about the due dates and who's enrolled, to compare against the last pull
+    course_state = get_course_state(config)
+
+    # start of the actual code. missing_dict is the actual api dump that we save.
+    # a full run starts from nothing and overwrites api.json. An incremental run starts from what we already have and
+    # only fully re-pulls the assignments it can't trust a delta for (see needs_full_sync).
+    if incremental and store.exists("api"):
+        missing_dict = store.checkout("api")
+        to_pull = []
+        to_update = []
+        for assignment in set(current_assignments):
+            if needs_full_sync(assignment, assignment_dict[assignment], missing_dict, sync_state, started, course_state):
+                to_pull.append(assignment)
+            else:
+                to_update.append(assignment)
+        print(f"{len(to_pull)} assignments need a full pull, {len(to_update)} only need changes.")
+    else:
+        missing_dict = {}
+        sync_state = {}
+        to_pull = list(set(current_assignments))
+        to_update = []
+
+    # every submission we get back, for the history (see record_history)
+    observed = [] if history_enabled(config) else None
+
+    # bulk mode pulls every submission for every assignment through the course-level endpoint instead of going
+    # assignment by assignment. Both give back the same missing_dict.
+    if config["API"].get("bulk", False):
+        missing_dict.update(pull_bulk_submissions(config, assignment_dict, to_pull, observed))
+    else:
+        missing_dict.update(pull_assignment_submissions(config, assignment_dict, to_pull, observed))
+
+    if to_update:
+        # everything getting a delta was last synced together, but go off the oldest cursor to be safe
+        since = min(sync_state[assignment]["synced_at"] for assignment in to_update)
+        changes = pull_submission_changes(config, to_update, assignment_dict, since)
+        apply_submission_changes(missing_dict, changes, assignment_dict, to_update)
+        if observed is not None:
+            observed += [(submission["assignment_id"], submission["user_id"], submission["grade"]) for submission in changes]
+
+    for assignment in to_pull + to_update:
+        sync_state[assignment] = {"id":assignment_dict[assignment]["id"], "missingif":assignment_dict[assignment]["missingif"],
+                                  "synced_at":started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                                  "due_at":course_state["due_at"].get(str(assignment_dict[assignment]["id"])),
+                                  "roster":course_state["roster"]}
+
     # dumps everything for later use
     print("All assignments pulled via API.")
-    with open("./userdata/api.json", "w") as file:
-        json.dump(missing_dict, file, indent=4)
+    store.write("api", missing_dict)
+    store.write("sync_state", sync_state)
+    if observed is not None:
+        record_history(config, started, observed, missing_dict, assignment_dict, to_pull + to_update)
+
+
+# adds what this pull saw to the submission history (history.py), marking each submission missing or not the same way
+# missing_dict does. A history that can't be saved shouldn't cost us the pull, so that only gets a warning.
+def history_enabled(config) -> bool:
+    return config.get("HISTORY", {}).get("enabled", True)
+
+def record_history(config, started, observed, missing_dict, assignment_dict, assignments) -> None:
+    import history
+    missing_sets = {}
+    for assignment in assignments:
+        missing_sets.setdefault(int(assignment_dict[assignment]["id"]), set()).update(missing_dict.get(assignment, []))
+    rows = [(int(assignment_id), user_id, user_id in missing_sets[int(assignment_id)], grade)
+            for assignment_id, user_id, grade in observed if int(assignment_id) in missing_sets]
+    try:
+        written = history.append(started, rows, config.get("HISTORY", {}).get("path", history.DIRECTORY))
+    except OSError as e:
+        print(f"Couldn't save the submission history: {e}")
+        return
+    print(f"{written} submission changes saved to the history.")
+
+
+# the due dates and roster as Canvas has them now: {"due_at": {assignment id: due_at}, "roster": fingerprint of the
+# student ids}. Both come through the response cache, so when nothing's changed it's a 304 per page. assignments.json
+# isn't good enough for the due dates, since api_scrape never updates one it already has.
+def get_course_state(config) -> dict:
+    course = str(config["API"]["course"])
+    client = get_client(config)
+    assignments = client.get_pages("courses/"+course+"/assignments", {"per_page":100}, "assignments", cached=True)
+    enrollments = client.get_pages("courses/"+course+"/enrollments", [("type[]", "StudentEnrollment"), ("per_page", 100)],
+                                   "student enrollments", cached=True)
+    return {"due_at":{str(assignment["id"]): assignment.get("due_at") for assignment in assignments},
+            "roster":roster_fingerprint(enrollment["user"]["id"] for enrollment in enrollments
+                                        if enrollment.get("role", "StudentEnrollment") == "StudentEnrollment")}
+
+def roster_fingerprint(user_ids) -> str:
+    return hashlib.sha256(",".join(str(user_id) for user_id in sorted(set(user_ids))).encode()).hexdigest()
+
+
+# decides whether an assignment can be brought up to date with just the submissions that changed since the last pull.
+# Canvas flips the missing flag on its own when the due date passes, and nothing about the submission "changes" when that
+# happens, so anything that came due since the last pull gets a full pull. Same if we've never pulled it, the
+# assignment's id or missing criteria changed since (the saved list was built with different rules), its due date moved
+# (an extension makes it missing again later, with no change to the submission), or students were added or dropped
+# (a new student's past due submission was never submitted or graded, so neither change stream would have it).
+# States saved before the due date and roster were kept get one full pull to fill them in.
+def needs_full_sync(assignment, assignment_info, missing_dict, sync_state, now, course_state) -> bool:
+    if assignment not in missing_dict or assignment not in sync_state:
+        return True
+    state = sync_state[assignment]
+    if state["id"] != assignment_info["id"] or state["missingif"] != assignment_info["missingif"]:
+        return True
+    due_at = course_state["due_at"].get(str(assignment_info["id"]))
+    if "due_at" not in state or state["due_at"] != due_at or state.get("roster") != course_state["roster"]:
+        return True
+    last_sync = datetime.datetime.strptime(state["synced_at"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+    if due_at is not None:
+        due = datetime.datetime.strptime(due_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc).timestamp()
+        if last_sync.timestamp() - SYNC_OVERLAP <= due <= now.timestamp():
+            return True
+    return False
+
+
+# asks Canvas for every submission to these assignments that was submitted or graded since the cursor. Those are two
+# separate filters on the bulk endpoint (Canvas ANDs them together), so they're two streams that run side by side.
+def pull_submission_changes(config, assignments, assignment_dict, since) -> list:
+    concurrency = get_concurrency(config)
+
+    # back the cursor up a bit so clock skew between us and Canvas can't drop anything. Re-applying a change is harmless.
+    since = datetime.datetime.strptime(since, "%Y-%m-%dT%H:%M:%SZ") - datetime.timedelta(seconds=SYNC_OVERLAP)
+    since = since.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    chunks = bulk_chunks(sorted(set(str(assignment_dict[assignment]["id"]) for assignment in assignments)), concurrency)
+
+    changes = []
+    with request_pool(concurrency) as pool:
+        streams = []
+        for chunk in chunks:
+            streams.append(pool.submit(walk_bulk_submissions, config, chunk, [("submitted_since", since)]))
+            streams.append(pool.submit(walk_bulk_submissions, config, chunk, [("graded_since", since)]))
+        for stream in streams:
+            changes += stream.result()
+    print(f"{len(changes)} submissions changed since {since}.")
+    return changes
+
+
+# merges changed submissions into the saved missing lists: whatever we had for that student on that assignment gets
+# dropped, then they're added back if the submission still counts as missing.
+def apply_submission_changes(missing_dict, changes, assignment_dict, assignments) -> None:
+    names_by_id = {}
+    for assignment in assignments:
+        names_by_id.setdefault(str(assignment_dict[assignment]["id"]), []).append(assignment)
+
+    for submission in changes:
+        for assignment in names_by_id.get(str(submission["assignment_id"]), []):
+            missing_dict[assignment] = [user for user in missing_dict[assignment] if user != submission["user_id"]]
+            missing_dict[assignment] += missing_from_submissions([submission], assignment_dict[assignment]["missingif"])
+
+
+# pulls submissions one assignment at a time with the /assignments/{id}/submissions endpoint.
+def pull_assignment_submissions(config, assignment_dict, assignments, observed=None) -> dict:
+    # how many requests we let run at once. older configs won't have this, so fall back to the default.
+    concurrency = get_concurrency(config)
+
+    # every request here is just waiting on Canvas, so we run them on a thread pool. First we grab page 1 of every
+    # assignment at once; Canvas tells us the last page in the Link header, so after that we can queue up every
+    # remaining page at once too. pages are kept in order so the lists come out the same as pulling them one by one.
+    missing_dict = {}
+    pages = {}
+    with request_pool(concurrency) as pool:
+        # page 1 of everything is the least we know we'll need; the rest gets added to the plan as Canvas tells us
+        sync_metrics.plan(len(assignments))
+        first_pages = {}
+        for assignment in assignments:
+            # canvas gradebook (and subsequently our code) embeds assignments as "name (assignment_id)". This strips the assignment ID.
+            # if we change this in the future, would make sense to fix this.
+            assignment_id = str(assignment_dict[assignment]["id"])
+            first_pages[assignment] = pool.submit(fetch_submission_page, config, assignment, assignment_id, 1)
+
+        for assignment, future in first_pages.items():
+            assignment_id = str(assignment_dict[assignment]["id"])
+            submissions, last_page = future.result()
+            pages[assignment] = [submissions]
+            if submissions == []:
+                print(f"Page 1 empty, moving on...")
+            elif last_page is not None:
+                sync_metrics.plan(last_page-1)
+                for page in range(2, last_page+1):
+                    pages[assignment].append(pool.submit(fetch_submission_page, config, assignment, assignment_id, page))
+            else:
+                # no Link header to go off of, so walk the rest of the pages one at a time (still alongside everything else)
+                pages[assignment].append(pool.submit(walk_submission_pages, config, assignment, assignment_id, 2))
+
+        for assignment in pages:
+            submissions = pages[assignment][0]
+            for future in pages[assignment][1:]:
+                submissions += future.result()[0]
+            missing_dict[assignment] = missing_from_submissions(submissions, assignment_dict[assignment]["missingif"])
+            if observed is not None:
+                assignment_id = assignment_dict[assignment]["id"]
+                observed += [(assignment_id, submission["user_id"], submission["grade"]) for submission in submissions]
+
+    return missing_dict
+
+
+# pulls every submission for the given assignments through the course-level /students/submissions endpoint.
+# this is one paginated stream per chunk of assignment IDs (instead of one per assignment), so the number of
+# requests scales with the total number of submissions rather than assignments x pages.
+def pull_bulk_submissions(config, assignment_dict, assignments, observed=None) -> dict:
+    concurrency = get_concurrency(config)
+
+    # submissions come back tagged with their assignment_id, so map those back to our assignment names.
+    # names are the keys in assignments.json, so more than one name could point at the same id.
+    names_by_id = {}
+    missing_dict = {}
+    for assignment in assignments:
+        names_by_id.setdefault(str(assignment_dict[assignment]["id"]), []).append(assignment)
+        missing_dict[assignment] = []
+
+    chunks = bulk_chunks(sorted(names_by_id.keys()), concurrency)
+
+    submissions_by_id = {}
+    with request_pool(concurrency) as pool:
+        streams = [pool.submit(walk_bulk_submissions, config, chunk) for chunk in chunks]
+        for stream in streams:
+            for submission in stream.result():
+                submissions_by_id.setdefault(str(submission["assignment_id"]), []).append(submission)
+                if observed is not None:
+                    observed.append((submission["assignment_id"], submission["user_id"], submission["grade"]))
+
+    for assignment_id, submissions in submissions_by_id.items():
+        for assignment in names_by_id.get(assignment_id, []):
+            missing_dict[assignment] = missing_from_submissions(submissions, assignment_dict[assignment]["missingif"])
+
+    return missing_dict
+
+
+# splits the assignment ids up into the queries that run side by side. Each query's pages can only be followed one
+# after the other, so there's at least one per worker (as long as there are enough assignments). Canvas is fine with a
+# good amount of assignment_ids[] in one query, but the url has to stop somewhere, so never more than
+# BULK_ASSIGNMENT_CHUNK in one.
+def bulk_chunks(ids, concurrency) -> list:
+    size = max(1, min(BULK_ASSIGNMENT_CHUNK, -(-len(ids) // concurrency)))
+    return [ids[i:i+size] for i in range(0, len(ids), size)]
+
+
+# follows one bulk submissions query through all of its pages.
+def walk_bulk_submissions(config, assignment_ids, filters=()) -> list:
+    course = str(config["API"]["course"])
+
+    params = [("student_ids[]", "all"), ("per_page", 100)]
+    params += [("assignment_ids[]", assignment_id) for assignment_id in assignment_ids]
+    params += list(filters)
+
+    label = f"bulk submissions ({len(assignment_ids)} assignments)"
+    if lean_submissions(config):
+        return get_client(config).get_record_pages("courses/"+course+"/students/submissions", params, SUBMISSION_FIELDS, label)
+    return get_client(config).get_pages("courses/"+course+"/students/submissions", params, label)
+
+
+# pulls down a single page of submissions for an assignment, and the last page number if Canvas gave us one.
+def fetch_submission_page(config, assignment, assignment_id, page):
+    course = str(config["API"]["course"])
+
+    print(f"Requesting page {page} of {assignment}...")
+    # below is the api path for the dump. You can look it over, it's pretty straightforward.
+    path = "courses/"+course+"/assignments/"+assignment_id+"/submissions"
+    import canvas_client
+    if lean_submissions(config):
+        submissions, r = get_client(config).get_records(path, {"per_page":100, "page":page}, SUBMISSION_FIELDS,
+                                                        label=f"page {page} of {assignment}")
+        return submissions, canvas_client.last_page(r)
+    params = {"per_page":100, "page":page, "include[]":"submission_history"}
+    r = get_client(config).get(path, params, label=f"page {page} of {assignment}")
+    return r.json(), canvas_client.last_page(r)
+
+# lean pulls leave out every submission's history (which is most of each page and never used) and only keep the fields
+# below out of each submission, reading them as the page comes in. Setting API.lean to false goes back to asking for
+# everything, in case something ever needs the rest.
+SUBMISSION_FIELDS = ["user_id", "assignment_id", "missing", "grade"]
+
+def lean_submissions(config) -> bool:
+    return config["API"].get("lean", True)
+
+
+# fallback for when we don't know how many pages there are: keep going until Canvas hands back an empty page.
+def walk_submission_pages(config, assignment, assignment_id, page):
+    submissions = []
+    while True:
+        sync_metrics.plan(1)
+        page_submissions = fetch_submission_page(config, assignment, assignment_id, page)[0]
+        if page_submissions == []:
+            # empty page, so we're done with this assignment
+            print(f"Page {page} empty, moving on...")
+            return submissions, None
+        submissions += page_submissions
+        page += 1
+
+
+# the offline way to fill in api.json: reads a Canvas gradebook export (see gradebook.py) instead of asking the API.
+# Every assignment the export has a column for gets its missing list replaced, anything else in api.json is left alone.
+def import_gradebook(path) -> None:
+    import gradebook
+    assignment_dict = get_assignments()
+    missing_dict, students = gradebook.read_missing(path, assignment_dict)
+    if missing_dict == {}:
+        print(f"None of the assignments in {path} are in assignments.json, nothing to import.")
+        return
+    api_dict = store.checkout("api", {})
+    api_dict.update(missing_dict)
+    store.write("api", api_dict)
+    print(f"Imported {len(missing_dict)} of {len(assignment_dict)} assignments for {students} students from {path}.")
+
+
+# checks each submission against the assignment's missing criteria and returns the user IDs that count as missing.
+def missing_from_submissions(submissions, missingif) -> list:
+    if type(missingif) != type([]):
+        missingif = [missingif]
+    missing = []
+    for submission in submissions:
+        for criterion in missingif:
+        # canvas just directly holds a boolean called missing for submittable assignments. freakin sweet
+            if submission["missing"] and criterion == "api":
+                # the way that we store missing assignments is a list of user IDs we cross-reference later. seemed okay to me
+                missing.append(submission["user_id"])
+            # handles 0 case for now  
+            elif submission["grade"] == criterion:
+                missing.append(submission["user_id"])
+    return missing
+
+
+# how many Canvas requests can be in flight at once. Canvas throttles per token, so keep this modest.
+def get_concurrency(config) -> int:
+    return max(1, int(config["API"].get("concurrency", 4)))
+
+# the thread pools Canvas requests run on. The workers pick up the calling thread's sync_metrics trackers and job log,
+# so their requests get counted and their output ends up in the right place.
+def request_pool(max_workers):
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=adopt_context,
+                              initargs=(sync_metrics.current(), jobs.current_log()))
+
+def adopt_context(trackers, log) -> None:
+    sync_metrics.adopt(trackers)
+    jobs.adopt_log(log)
+
+# where the Canvas API lives. Defaults to our instance, but can be pointed somewhere else (like a local stand-in for testing).
+def get_base_url(config) -> str:
+    base_url = config["API"].get("base_url", "https://uncc.instructure.com/api/v1/")
+    if not base_url.endswith("/"):
+        base_url += "/"
+    return base_url
+
+# hands back the shared Canvas client for this config. Clients hold onto their connection pool and throttling state,
+# so we keep one around per api key/url instead of starting fresh on every call. The userdata folder is part of the
+# key too, since each one has its own response cache (the batch runner moves between course folders).
+def get_client(config):
+    import canvas_client
+    import http_cache
+    base_url = get_base_url(config)
+    apikey = str(config["API"]["apikey"])
+    userdata = os.path.abspath("./userdata")
+    key = (base_url, apikey, userdata)
+    with client_lock:
+        if key not in clients:
+            # course metadata (assignment and module lists) is cached on disk and revalidated with ETags. 0 turns it off.
+            cache = None
+            cache_mb = float(config["API"].get("cache_mb", 50))
+            if cache_mb > 0:
+                cache = http_cache.ResponseCache(os.path.join(userdata, "http_cache"), max_bytes=int(cache_mb*1024*1024))
+            # a couple of spare connections past the thread count for anything running outside the pool
+            clients[key] = canvas_client.CanvasClient(base_url, apikey, pool_size=get_concurrency(config)+2,
+                                                      max_retries=int(config["API"].get("max_retries", 6)), cache=cache,
+                                                      throttler=canvas_client.Throttler(shared=shared_limit))
+        return clients[key]
 
 
 
@@ -150,10 +493,28 @@ def is_missing(student, api_dict):
         return False
 
 
+# builds the lookup make_emails uses to answer "what is this student missing?" Goes over each assignment's missing list
+# once and gives back {user_id: [positions in assignments that they're missing]}. The positions come out sorted, so
+# they're already in the order the assignments were sent. Assignments that show up twice are counted twice, and
+# a student listed twice on one assignment's list is still only missing it once.
+def build_missing_index(api_dict, assignments) -> dict:
+    missing_sets = {}
+    missing_index = {}
+    for position, assignment in enumerate(assignments):
+        if assignment not in missing_sets:
+            missing_sets[assignment] = set(api_dict[assignment])
+        for user in missing_sets[assignment]:
+            if user in missing_index:
+                missing_index[user].append(position)
+            else:
+                missing_index[user] = [position]
+    return missing_index
+
+
 ### imported from runner ###
 # this is the big one. This is what actually produces the output file that is used to send emails.
-# it's a big func, so i'll try to be clear with everything that happens.
-# longterm, I think we should rewrite this to be more modular and customizable by users.
+# the columns themselves live in report_fields.py: the REPORT config gets turned into a list of column functions
+# once, and then each student is just a run through that list.
 def make_emails(current_week) -> None:
     # get all assignments controlled by the api
     api_dict = get_api_data()
@@ -170,33 +531,10 @@ def make_emails(current_week) -> None:
 
     weeks = get_week_names()
 
-    include_items = config['REPORT']["include"].keys()
-    field_name_dict = config['REPORT']["include"]
-
     field_names = []
-    for item in include_items:
+    for item in config['REPORT']["include"]:
         field_names.append(config['REPORT']['include'][item]['fieldname'])
 
-    customization_dict = {}
-
-    for item in include_items:
-        customization_dict[item] = {}
-        customization_dict[item]["child"] = {}
-        if item in config['REPORT']['customization'].keys():
-            customization_dict[item]["prefix"] = config['REPORT']['customization'][item]["prefix"]
-            customization_dict[item]["postfix"] = config['REPORT']['customization'][item]["postfix"]
-            if "child" in config['REPORT']['customization'][item].keys():
-                customization_dict[item]["child"]["prefix"] = config['REPORT']['customization'][item]["child"]["prefix"]
-                customization_dict[item]["child"]["postfix"] = config['REPORT']['customization'][item]["child"]["postfix"]
-            else:
-                customization_dict[item]["child"]["prefix"] = ""
-                customization_dict[item]["child"]["postfix"] = ""
-        else:
-            customization_dict[item]["prefix"] = ""
-            customization_dict[item]["postfix"] = ""
-            customization_dict[item]["child"]["prefix"] = ""
-            customization_dict[item]["child"]["postfix"] = ""
-
     print(weeks.index(current_week))
     weeks_to_send = weeks[:weeks.index(current_week)] + [current_week]
     print(weeks_to_send)
@@ -206,147 +544,274 @@ def make_emails(current_week) -> None:
     for week in weeks_to_send:
         current_assignments += week_map[week]["assignments"]
 
-    # this is what checks for and opens the gradebook for utilization.
-    for file in os.listdir():
-        if (file.split(".")[-1] == "csv"):
-            workfile = file
+    # instead of checking every student against every assignment's missing list, flip it around once up front:
+    # each student gets the (in order) positions of the assignments they're missing. See build_missing_index().
+    missing_index = build_missing_index(api_dict, current_assignments)
 
-    # this sets some of the things included in the export.
-    # module, number of assignments, and the list of assignments for the module are done here.
-    module = week_map[current_week]["name"]
-    assignment_count = len(week_map[current_week]["assignments"])
-    # logic to get the list of assignments mapped to the current module
-    
-    if "assignment_list" in include_items:
-        item = "assignment_list"
-        assignment_list = ""
-        for assignment in week_map[current_week]["assignments"]:
-            # this logic cuts the numbers from the assignment when sending it to students.
-            assignment_list += customization_dict[item]["child"]["prefix"]+assignment+customization_dict[item]["child"]["postfix"]
-
-    # counts the total number of assignments which have been due so far, sums the number of assignments in each module.
-    if "total_complete" in include_items or "late_assignment_list" in include_items or "actual_completed" in include_items:
-        total_complete = 0
-        for week in weeks_to_send:
-            total_complete += len(week_map[week]["assignments"])
-
-    # counts the total number of assignments due so far too. I believe I changed this code at some point due to a non-Yfunctional output. 
-    if "total_course_assignments" in include_items:
-        total_course_assignments = 0
-        for week in weeks:
-            total_course_assignments += len(week_map[week]["assignments"])
-
-
-    # okay, time for the meat of the function.
-    data = []
+    # everything the columns need that's the same for every student
+    run = {"week_map":week_map, "weeks":weeks, "current_week":current_week, "weeks_to_send":weeks_to_send,
+           "current_assignments":current_assignments, "assignment_dict":assignment_dict,
+           # the current module is always the last one sent, so its assignments are the tail end of current_assignments
+           "module_start":len(current_assignments) - len(week_map[current_week]["assignments"])}
+    columns = report_fields.compile_columns(config, run)
+
+    # okay, time for the meat of the function. rows are made one student at a time as the writer asks for them,
+    # so nothing piles up in memory no matter how big the class is.
+    write_export(export_path(week_map[current_week]), field_names, report_rows(students, missing_index, column_slots(field_names, columns)))
+
+
+# makes each student's row for the export, one at a time
+def report_rows(students, missing_index, slots):
     for student in students:
-        # grab the first item, and get their first name (Canvas stores Last, First)
-        entry_dict = {}
-
-        #eventually this could probably be a series of function calls that pass these things... womp womp
-        if "name" in include_items:
-            item = "name"
-            entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+students[student]["name"].split(", ")[-1]+customization_dict[item]["postfix"]
-        # grab student email
-        if "email" in include_items:
-            entry_dict[field_name_dict["email"]["fieldname"]] = students[student]["email"]
-        
-        if "module" in include_items:
-            item = "module"
-            entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+module+customization_dict[item]["postfix"]
-
-        if "assignment_count" in include_items:
-            item = "assignment_count"
-            entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+str(assignment_count)+customization_dict[item]["postfix"]
-
-        if "assignment_list" in include_items:
-            item = "assignment_list"
-            entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+str(assignment_list)+customization_dict[item]["postfix"]
-
-        if "total_course_assignments" in include_items:
-            item = "total_course_assignments"
-            entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+str(total_course_assignments)+customization_dict[item]["postfix"]
-
-        if "total_complete" in include_items:
-            item = "total_complete"
-            entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+str(total_complete)+customization_dict[item]["postfix"]
-
-        # for the module, set the total completed to the max that can be. If something isn't complete, mark it as missing, and decrease the count.
-        if "module_completed" in include_items:
-            item = "module_completed"
-            module_completed = assignment_count
-            for assignment in week_map[current_week]["assignments"]:
-                if is_missing(students[student]["id"], api_dict[assignment]):
-                    module_completed -= 1
-            entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+str(module_completed)+customization_dict[item]["postfix"]
-            
+        record = students[student]
+        yield report_row(record, missing_index.get(record["id"], []), slots)
+
+# rows are plain lists in the export's column order, which saves csv from looking every column up by name for every
+# row. slots says where each column's value goes (see column_slots); anything left blank stays "".
+def report_row(record, missing, slots) -> list:
+    entry = [""] * slots[0]
+    for positions, fill in slots[1]:
+        value = fill(record, missing)
+        if value is not None:
+            for position in positions:
+                entry[position] = value
+    return entry
+
+# turns compile_columns' (column name, fill) list into (row width, [(positions, fill)]). A name that shows up more than
+# once in the header gets the value in every spot it's in, like a dict row would.
+def column_slots(field_names, columns) -> tuple:
+    return (len(field_names), [([index for index, name in enumerate(field_names) if name == field_name], fill)
+                               for field_name, fill in columns])
+
+
+# the same report as make_emails, for every module at once (Homeless Assignments aside). A module's report covers it
+# and everything before it, which is always the start of the same list of assignments, so the missing index only gets
+# built once, over the whole list. Each module just cuts every student's (sorted) missing positions off at the end of
+# that module, which is where its total_complete/actual_completed counts come from. Every export gets written in the
+# same pass over the students.
+# Modules past the last one with all of its assignments pulled are left out, since there's nothing to report on yet.
+def make_all_emails() -> list:
+    api_dict = get_api_data()
+    config = get_config()
+    assignment_dict = get_assignments()
+    students = get_student_data()
+    week_map = get_week_data()
+    weeks = get_week_names()
 
-        # same thing as before, BUT we're now going over the entire course. We also keep a record of the names of late assignments.
-        # we do this so we can send the students a list of the assignments they can work on.
-        if "actual_completed" in include_items or late_assignment_list in include_items:
-            item = "late_assignment_list"
-            actual_completed = total_complete
-            late_assignment_list = ""
-            for week in weeks_to_send:
-                for assignment in week_map[week]["assignments"]:
-                    if is_missing(students[student]["id"], api_dict[assignment]):
-
-                        if assignment_dict[assignment]["showonlatelist"] != "False" and "late_assignment_list" in include_items:
-                            late_assignment_list += customization_dict[item]["child"]["prefix"]+assignment+customization_dict[item]["child"]["postfix"]
-                        
-                        actual_completed -= 1
-            if "actual_completed" in include_items:
-                item = "actual_completed"
-                entry_dict[field_name_dict[item]["fieldname"]] = customization_dict[item]["prefix"]+str(actual_completed)+customization_dict[item]["postfix"]
-
-        # if anything is missing, we throw on this line for the email.
-        if "late_assignment_list" in include_items and late_assignment_list != "":
-            item = "late_assignment_list"
-            entry_dict[field_name_dict[item]["fieldname"]] =  customization_dict[item]["prefix"]+late_assignment_list+customization_dict[item]["postfix"]
-
-        # this appends everything as it'll go into the export. Pretty clear. 
-        data.append(entry_dict)
-    # logic to catch naming conventions based on OS
-    if ":" in week_map[week]['name']:
-        file = open(f"exports/Report - {week_map[week]['name'].split(':')[0]}.csv", "w", newline="")
-    else:
-        file = open(f"exports/Report - {week_map[week]['name']}.csv", "w", newline="")
-    # write everything
-    writer = csv.DictWriter(file, fieldnames=field_names)
-    writer.writeheader()
-    writer.writerows(data)
-    file.close()
+    field_names = []
+    for item in config['REPORT']["include"]:
+        field_names.append(config['REPORT']['include'][item]['fieldname'])
 
+    all_assignments = []
+    reports = []
+    for index, week in enumerate(weeks):
+        if any(assignment not in api_dict for assignment in week_map[week]["assignments"]):
+            print(f"{week} hasn't been pulled yet, so the reports stop at the module before it.")
+            break
+        all_assignments += week_map[week]["assignments"]
+        if week == "Homeless Assignments":
+            continue
+        end = len(all_assignments)
+        run = {"week_map":week_map, "weeks":weeks, "current_week":week, "weeks_to_send":weeks[:index+1],
+               "current_assignments":all_assignments[:end], "assignment_dict":assignment_dict,
+               "module_start":end - len(week_map[week]["assignments"])}
+        reports.append((week, end, column_slots(field_names, report_fields.compile_columns(config, run))))
 
+    missing_index = build_missing_index(api_dict, all_assignments)
+
+    paths = [export_path(week_map[week]) for week, end, slots in reports]
+    write_exports(paths, field_names, all_report_rows(students, missing_index, reports))
+    print(f"Made {len(paths)} reports in ./exports")
+    return [week for week, end, slots in reports]
+
+
+# every report's row for each student (a list, in the same order as the reports)
+def all_report_rows(students, missing_index, reports):
+    for student in students:
+        record = students[student]
+        missing = missing_index.get(record["id"], [])
+        yield [report_row(record, missing[:bisect.bisect_left(missing, end)], slots) for week, end, slots in reports]
+
+
+# logic to catch naming conventions based on OS
+def export_path(module) -> str:
+    return f"exports/Report - {report_name(module)}.csv"
+
+# the part before the first ':' (which can't go in a file name on Windows), unless another module starts the same way
+# ("Module 01: Unit 1", "Module 01: Unit 2"), in which case it's the whole name with the ':' swapped out, so no two
+# modules share a report (or a send log entry)
+def report_name(module) -> str:
+    short = module['name'].split(':')[0]
+    # Homeless Assignments doesn't have a name, so it goes by its key
+    others = [other.get('name', key).split(':')[0] for key, other in get_week_data().items()]
+    if ":" in module['name'] and others.count(short) > 1:
+        return module['name'].replace(':', ' -')
+    return short
+
+
+# writes the rows to a temp file next to the export and swaps it in once everything's written. If something breaks
+# partway through, the last good export is left alone.
+def write_export(path, field_names, rows) -> None:
+    write_exports([path], field_names, ([row] for row in rows))
+
+# same thing for several exports written side by side: each item from rows is a list with a row for each path.
+def write_exports(paths, field_names, rows) -> None:
+    # two exports with the same path would write over each other's temp file, so check before anything gets opened
+    repeated = sorted(set(path for path in paths if paths.count(path) > 1))
+    if repeated != []:
+        raise ValueError(f"More than one module would be saved as {', '.join(repeated)}. Give the modules different "
+                         f"names (Combine/Rename Modules) and try again.")
+    # every temp file is written and closed before any of them gets moved into place (see atomic.py)
+    with atomic.open_all(paths, "w", newline="") as files:
+        writers = [csv.writer(file) for file in files]
+        for writer in writers:
+            writer.writerow(field_names)
+        for row in rows:
+            for writer, entry in zip(writers, row):
+                writer.writerow(entry)
+
+
+
+# class-level numbers for the module's report (see analytics.py): completion rates for the course, each module and each
+# assignment due so far, how many students have done how many, and who's falling behind. Saved next to the report as
+# "Analytics - <module>.csv".
+def make_analytics(current_week) -> str:
+    import analytics
+    api_dict = get_api_data()
+    config = get_config()
+    students = list(get_student_data().values())
+    week_map = get_week_data()
+    weeks = get_week_names()
+
+    weeks_to_send = weeks[:weeks.index(current_week)+1]
+    current_assignments = []
+    modules = []
+    for week in weeks_to_send:
+        current_assignments += week_map[week]["assignments"]
+        # Homeless Assignments still counts toward everything else (like it does in the report), it just doesn't get
+        # a module row. It doesn't have a name anyway.
+        name = None if week == "Homeless Assignments" else week_map[week].get("name", week)
+        modules.append((name, len(week_map[week]["assignments"])))
+
+    completed = analytics.completion_matrix([student["id"] for student in students], api_dict, current_assignments)
+    at_risk_below = config.get("ANALYTICS", {}).get("at_risk_below", analytics.AT_RISK_BELOW)
+    rows = analytics.summarize(completed, current_assignments, modules, students, at_risk_below)
+
+    path = f"exports/Analytics - {report_name(week_map[current_week])}.csv"
+    write_export(path, analytics.HEADER, rows)
+    print(f"{sum(1 for row in rows if row[0] == 'at_risk')} of {len(students)} students are at risk. Saved to {path}")
+    return path
+
+
+# the module's report (made by make_emails) ready to be turned into emails: the email settings, the template bound to
+# the report's columns, which column has the address, and the rows. The template gets checked against the REPORT
+# columns here, before a single email is made.
+def report_for_emails(current_week) -> tuple:
+    import email_template
+    import mailer
+    config = get_config()
+    settings = mailer.get_settings(config)
+    week_map = get_week_data()
+
+    path = export_path(week_map[current_week])
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"There's no report for {current_week} yet ({path}), make the emails first.")
+    if "email" not in config['REPORT']['include']:
+        raise ValueError("The report needs the email column (REPORT.include.email) to know where to send each row.")
+
+    template = email_template.load(settings["template"])
+    template.validate([config['REPORT']['include'][item]['fieldname'] for item in config['REPORT']['include']])
+    with open(path, "r", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = list(reader)
+    # the report might be older than the config, so check it has everything too
+    renderer = template.bind(header)
+    email_column = header.index(config['REPORT']['include']['email']['fieldname'])
+    return settings, renderer, email_column, [row for row in rows if addressed(row, email_column)]
+
+def addressed(row, email_column) -> bool:
+    if len(row) <= email_column or not row[email_column]:
+        print(f"No email address for {row}, skipping.")
+        return False
+    return True
+
+# emails each student their row of the module's report, through the SMTP server in config['EMAIL']. See mailer.py for
+# the batching and the send log that keeps reruns from double sending.
+def send_emails(current_week) -> dict:
+    import mailer
+    settings, renderer, email_column, rows = report_for_emails(current_week)
+    if not settings["from"]:
+        raise ValueError("Set EMAIL.from in ./userdata/config.json to the address the emails should come from.")
+    messages = [(row[email_column], mailer.build_message(renderer, row, row[email_column], settings)) for row in rows]
+
+    with request_pool(max(1, int(settings["connections"]))) as pool:
+        result = mailer.send_all(messages, settings, current_week, pool)
+    print(f"Sent {result['sent']} emails for {current_week}, {result['skipped']} already sent, {result['failed']} failed.")
+    if result["failed"]:
+        print("Running this again will retry the ones that failed (and skip everyone that got theirs).")
+    return result
+
+# saves the module's emails as files instead of sending them, for looking over or for sending some other way: a
+# folder of .eml files, or one mbox file with all of them (mbox=True). Hands back where they went.
+def save_emails(current_week, mbox=False) -> str:
+    import email_template
+    import mailer
+    settings, renderer, email_column, rows = report_for_emails(current_week)
+    # made the same way send_emails makes them, so the files are exactly what would go out
+    messages = ((row[email_column], mailer.build_message(renderer, row, row[email_column], settings).as_bytes())
+                for row in rows)
+    name = report_name(get_week_data()[current_week])
+    if mbox:
+        path = f"exports/Emails - {name}.mbox"
+        count = email_template.write_mbox(path, messages)
+    else:
+        path = f"exports/Emails - {name}"
+        count = email_template.write_eml(path, messages)
+    print(f"Saved {count} emails for {current_week} to {path}")
+    return path
 
 # new function: this is being written to utilize the api to pull assignments, removing the need for the gradebook.
 # other stuff will have to be rewritten, but this is the start of the pipeline.
+@sync_metrics.tracked("api_scrape")
 def api_scrape() -> None:
 
-    keys = ["name", "id", "missingif", "duedate", "duetimestamp", "showonlatelist"]
-    defaults = ["No Name Found", 000000, "api", "2016-10-05 12:00:00", 1475683200.0, "True"]
-    
     config = get_config()
 
-    assignments = get_assignments()
+    # private copies, since we fill these in and save them back
+    assignments = store.checkout("assignments")
 
-    modules = get_week_data()
+    modules = store.checkout("modules")
 
     # a lot of this config reading (which we may add more) can eventually be put somewhere less scoped
-    apikey = str(config["API"]["apikey"])
     course = str(config["API"]["course"])
+    client = get_client(config)
+
+    # Canvas caps per_page at 100, so bigger courses come back over a few pages
+    new_assignments = client.get_pages("courses/"+course+"/assignments", {"per_page":100}, "assignments", cached=True)
+    export = merge_assignments(assignments, new_assignments)
+    store.write("assignments", export)
+
+    # the modules come with what's in them, so assignments can be put in their modules without anyone copying them over
+    # by hand. Canvas leaves the items out of modules with a lot in them, those get asked for on their own.
+    new_modules = client.get_pages("courses/"+course+"/modules", {"per_page":100, "include[]":"items"}, "modules", cached=True)
+    for module in new_modules:
+        if "items" not in module and module.get("items_url") is not None:
+            module["items"] = client.get_pages(module["items_url"], {"per_page":100}, f"items in {module['name']}", cached=True)
+
+    item_index = None
+    if config["API"].get("map_modules", True):
+        item_index = module_item_index(new_assignments)
+    modules = merge_modules(modules, new_modules, list(export.keys()), item_index)
+    store.write("modules", modules)
 
-    # build the api query
-    query = "https://uncc.instructure.com/api/v1/courses/"+course+"/assignments?access_token="+apikey+"&per_page=250"
-    r = requests.get(query)
-    # sometimes Canvas will get mad at the number of requests, depending on the speed of the data transfer. This catches that issue and sleeps
-    # the thread long enough to let us try again.
-    while r.status_code == 403:
-        print(f"Status Code 403, rerequesting assignments...")
-        time.sleep(2)
-        r = requests.get(query)
 
-    new_assignments = json.loads(r.text)
+# folds the assignments Canvas gave us into what's saved: new ones get filled in, old ones keep whatever was set by
+# hand (missing keys get defaults). Hands back the assignments sorted by due date, ready to save. Changes assignments.
+def merge_assignments(assignments, new_assignments) -> dict:
+
+    keys = ["name", "id", "missingif", "duedate", "duetimestamp", "showonlatelist"]
+    defaults = ["No Name Found", 000000, "api", "2016-10-05 12:00:00", 1475683200.0, "True"]
 
     for assignment in new_assignments:
 
@@ -380,20 +845,14 @@ def api_scrape() -> None:
         export[item[0]] = item[1]
         if type(export[item[0]]["duedate"]) != type(""):
             export[item[0]]["duedate"] = export[item[0]]["duedate"].strftime("%Y-%m-%d %H:%M:%S")
+    return export
 
-    with open("./userdata/assignments.json", "w") as file:
-        json.dump(export, file, indent=4)
-
-    query = "https://uncc.instructure.com/api/v1/courses/"+course+"/modules?access_token="+apikey+"&per_page=250"
-    r = requests.get(query)
-    # sometimes Canvas will get mad at the number of requests, depending on the speed of the data transfer. This catches that issue and sleeps
-    # the thread long enough to let us try again.
-    while r.status_code == 403:
-        print(f"Status Code 403, rerequesting data...")
-        time.sleep(2)
-        r = requests.get(query)
 
-    new_modules = json.loads(r.text)
+# adds any modules Canvas has that we don't yet, and rebuilds "Homeless Assignments" out of every assignment that isn't
+# in a module. With an item_index (see module_item_index), assignments that aren't in a module yet get put in the one
+# Canvas has them in; anything already placed stays where it is, so moving things around by hand still sticks.
+# Changes modules.
+def merge_modules(modules, new_modules, assignment_names, item_index=None) -> dict:
 
     for module in new_modules:
        if module["name"] not in list(modules.keys()):
@@ -402,68 +861,81 @@ def api_scrape() -> None:
     if "Homeless Assignments" in list(modules.keys()):
         del modules["Homeless Assignments"]
 
-    assignments = list(export.keys())
-    temp = list(assignments)
-    for assignment in temp:
-        for module in list(modules.keys()):
-            if assignment in modules[module]["assignments"]:
-                assignments.remove(assignment)
-                break
+    # every assignment that's already in a module, so nothing needs to search the module lists
+    placed = set()
+    for module in modules.values():
+        placed.update(module["assignments"])
+
+    if item_index is not None:
+        known = set(assignment_names)
+        for module in new_modules:
+            for item in module.get("items", []):
+                assignment = item_index.get((item.get("type"), item.get("content_id")))
+                if assignment is not None and assignment in known and assignment not in placed:
+                    modules[module["name"]]["assignments"].append(assignment)
+                    placed.add(assignment)
+
     modules["Homeless Assignments"] = {}
-    modules["Homeless Assignments"]["assignments"] = assignments
+    modules["Homeless Assignments"]["assignments"] = [assignment for assignment in assignment_names if assignment not in placed]
+    return modules
+
 
-    with open("./userdata/modules.json", "w") as file:
-        json.dump(modules, file, indent=4)
+# module items point at what they hold by type and id, and quizzes and graded discussions use their quiz/topic id
+# instead of the assignment's. Maps every (item type, content id) that can mean one of these assignments to its name.
+def module_item_index(new_assignments) -> dict:
+    index = {}
+    for assignment in new_assignments:
+        index[("Assignment", assignment["id"])] = assignment["name"]
+        if assignment.get("quiz_id") is not None:
+            index[("Quiz", assignment["quiz_id"])] = assignment["name"]
+        if assignment.get("discussion_topic") is not None:
+            index[("Discussion", assignment["discussion_topic"]["id"])] = assignment["name"]
+    return index
                 
-        
 
 
 
 # made to get a list of students for the class
+# this used to page through /users and then ask for every user's enrollments one at a time just to check their role.
+# the enrollments endpoint can be filtered to students and already carries the user (and their section), so the whole
+# roster comes down in a single paginated query, plus one more for the section names.
+@sync_metrics.tracked("get_students")
 def get_students() -> None:
-    #TODO: Add something that captures the student's section. This may be more involved than the users API.
-
-    with open("./userdata/config.json", "r") as readfile:
-        config = json.load(readfile)
-        readfile.close()
 
-    apikey = str(config["API"]["apikey"])
+    config = get_config()
     course = str(config["API"]["course"])
+    base = "courses/"+course
 
-    students_dict = {}
-    page = 1
-
-    while True:
-
-        query = "https://uncc.instructure.com/api/v1/courses/"+course+"/users?access_token="+apikey+"&per_page=250&page="+str(page)
+    client = get_client(config)
+    sections = client.get_pages(base+"/sections", [("per_page", 100)], "sections")
+    enrollments = client.get_pages(base+"/enrollments", [("type[]", "StudentEnrollment"), ("per_page", 100)], "student enrollments")
 
-        r = requests.get(query)
+    students_dict = students_from_enrollments(enrollments, sections)
+    print(f"found {len(students_dict)} students")
 
-        while r.status_code == 403:
-            print(f"Status Code 403, rerequesting data...")
-            time.sleep(2)
-            r = requests.get(query)
+    store.write("students", students_dict)
 
-        if r.text == "[]":
-            break
+# builds the students.json layout out of enrollment records. Students enrolled in more than one section show up
+# once per enrollment, so their section names get joined together.
+def students_from_enrollments(enrollments, sections) -> dict:
+    section_names = {}
+    for section in sections:
+        section_names[section["id"]] = section["name"]
 
-        users = json.loads(r.text)
-        for user in users:
-            query2 = "https://uncc.instructure.com/api/v1/courses/"+course+"/enrollments?access_token="+apikey+"&user_id="+str(user["id"])
-            r2 = requests.get(query2)
-            while r2.status_code == 403:
-                print(f"Status Code 403, rerequesting data...")
-                time.sleep(2)
-                r2 = requests.get(query2)
-            student = json.loads(r2.text)[0]
-            if student["role"] == "StudentEnrollment":
-                student_id = student["user"]["login_id"]
-                print(f"found student: {student_id}")
-                students_dict[student_id] = {"name":student["user"]["sortable_name"], "email":student["user"]["login_id"]+"@charlotte.edu", "id":student["user"]["id"]}
-        page += 1
-
-    with open("./userdata/students.json", "w") as writefile:
-        json.dump(students_dict, writefile, indent=4)
+    students_dict = {}
+    for enrollment in enrollments:
+        if enrollment["role"] != "StudentEnrollment":
+            continue
+        user = enrollment["user"]
+        student_id = user["login_id"]
+        section = section_names.get(enrollment["course_section_id"], "")
+        if student_id in students_dict:
+            if section not in students_dict[student_id]["section"].split(", "):
+                students_dict[student_id]["section"] += ", "+section
+            continue
+        students_dict[student_id] = {"name":user["sortable_name"], "email":user["login_id"]+"@charlotte.edu", "id":user["id"],
+                                     "section":section, "section_id":enrollment["course_section_id"]}
+    return students_dict
 
 # sets up user configuration if it isnt present.
 # everything in userdata is ignored by git, so we want to populate it all when the user launches (if its not there)
@@ -482,24 +954,18 @@ def setup_data(args):
         make_config()
 
     if "assignments" in args:
-        with open('./userdata/assignments.json', 'w') as writefile:
-            json.dump({}, writefile, indent=4)
-            writefile.close()
+        store.write("assignments", {})
 
     if "modules" in args:
-        with open('./userdata/modules.json', 'w') as writefile:
-            json.dump({}, writefile, indent=4)
-            writefile.close()
+        store.write("modules", {})
 
     if "students" in args:
-        with open('./userdata/students.json', 'w') as writefile:
-            json.dump({}, writefile, indent=4)
-            writefile.close()
+        store.write("students", {})
 
     if "api" in args:
-        with open('./userdata/api.json', 'w') as writefile:
-            json.dump({}, writefile, indent=4)
-            writefile.close()
+        store.write("api", {})
+        # the sync cursors only mean anything alongside the api data they were saved with
+        store.write("sync_state", {})
 
 
 # since the config is particularly fiddly, it makes most since to have it be its own subfunc
@@ -512,8 +978,21 @@ def make_config() -> None:
                              "Total Complete", "Late Assignments"]
     config = {}
     config['DEFAULT'] = {'placeholder':''}
-    config['API'] = {'apikey':'your_api_key_here', 'course':'your_course_here'}
+    config['API'] = {'apikey':'your_api_key_here', 'course':'your_course_here', 'concurrency':4, 'max_retries':6, 'bulk':False, 'incremental':False, 'lean':True, 'map_modules':True, 'cache_mb':50,
+                     'base_url':'https://uncc.instructure.com/api/v1/'}
     config['REPORT'] = {'customization':{}, 'include':{}}
+    # courses for the batch runner (batch.py). Each entry is a course id, or {"course": id, "week": module name}.
+    config['BATCH'] = {'courses':[], 'workers':4, 'directory':'./courses', 'requests_per_second':10}
+    # where everything but the config is kept: "json" files, or a single "sqlite" database (see sqlite_store.py)
+    config['STORAGE'] = {'backend':'json', 'path':'./userdata/userdata.sqlite'}
+    # every submission pull also gets added to a Parquet history here (see history.py)
+    config['HISTORY'] = {'enabled':True, 'path':'./userdata/history'}
+    # students who've done less than this much of what's been due get listed as at risk in the analytics
+    config['ANALYTICS'] = {'at_risk_below':0.7}
+    # the mail server send_emails uses (see mailer.py). security is "none", "starttls" or "ssl".
+    config['EMAIL'] = {'host':'localhost', 'port':25, 'security':'none', 'username':'', 'password':'', 'from':'', 'reply_to':'',
+                       'template':'./userdata/email_template.txt', 'connections':3, 'batch_size':50, 'batch_pause':1.0, 'per_minute':0,
+                       'log':'./userdata/send_log.jsonl'}
 
     config['REPORT']['customization'] = {"late_assignment_list": {"prefix": "","postfix": "","child": {"prefix": "- ","postfix": "\n"}},
                                          "assignment_list": {"prefix": "","postfix": "","child": {"prefix": "- ","postfix": "\n"}}}  
@@ -521,9 +1000,7 @@ def make_config() -> None:
     for index, element in enumerate(elements):
         config['REPORT']['include'][element] = {"fieldname":default_element_names[index]}
 
-    with open('./userdata/config.json', 'w') as writefile:
-        json.dump(config, writefile, indent=4)
-        writefile.close()
+    store.write("config", config)
 
 def get_week() -> str:
 
@@ -538,16 +1015,11 @@ def get_week() -> str:
     return module_names[input_string-1]
 
 def canvas_assignment_dump() -> None:
-    with open("./userdata/config.json", "r") as readfile:
-        config = json.load(readfile)
-        readfile.close()
+    config = get_config()
 
     # a lot of this config reading (which we may add more) can eventually be put somewhere less scoped
-    apikey = str(config["API"]["apikey"])
     course = str(config["API"]["course"])
-    query = "https://uncc.instructure.com/api/v1/courses/"+course+"/assignments?access_token="+apikey+"&per_page=250"
-    r = requests.get(query)
-    export = json.loads(r.text)
+    export = get_client(config).get_pages("courses/"+course+"/assignments", {"per_page":100}, "assignments", cached=True)
     with open("./userdata/canvas_assignments_dump.json", "w") as file:
         json.dump(export, file, indent=4)
 
@@ -557,9 +1029,7 @@ def combine_modules(weeks, newname) -> None:
     # Bit of fluff for reading
     print("\n")
 
-    with open("./userdata/modules.json", "r") as readfile:
-        modules = json.load(readfile)
-        readfile.close()
+    modules = store.checkout("modules")
 
     # Create the newmodule as a separate unit at first; in case it shares name with existing module
     newmodule = {"id":-1, "name":newname, "assignments":[]}
@@ -573,8 +1043,7 @@ def combine_modules(weeks, newname) -> None:
     modules[newname] = newmodule
 
     # Save it
-    with open("./userdata/modules.json", "w") as file:
-        json.dump(modules, file, indent=4)
+    store.write("modules", modules)
 
 
 
@@ -613,14 +1082,10 @@ def get_weeks() -> list:
 
 def change_late_list(week) -> None:
 
-    with open("./userdata/modules.json", "r") as readfile:
-        modules = json.load(readfile)
-        weeks = list(modules.keys())[::-1]
-        readfile.close()
+    modules = get_week_data()
+    weeks = list(modules.keys())[::-1]
 
-    with open("./userdata/assignments.json", "r") as readfile:
-        assignments = json.load(readfile)
-        readfile.close()
+    assignments = get_assignments()
 
     current_weeks = weeks[:weeks.index(week)] + [week]
     
@@ -652,17 +1117,17 @@ def change_late_list(week) -> None:
 # I wrote this as a standalone just in case this is useful somewhere else.
 def flip_late_status(assignments):
 
-    assignment_data = get_assignments()
+    assignment_data = store.read("assignments")
 
+    # saved all together: one write of assignments.json, or with the SQLite backend a row update per assignment in one
+    # transaction instead of rewriting every assignment
+    changes = []
     for assignment in assignments:
         if assignment_data[assignment]["showonlatelist"] == "True":
-            assignment_data[assignment]["showonlatelist"] = "False"
+            changes.append((assignment, "showonlatelist", "False"))
         else:
-            assignment_data[assignment]["showonlatelist"] = "True"
-
-    with open('./userdata/assignments.json', 'w') as writefile:
-            json.dump(assignment_data, writefile, indent=4)
-            writefile.close()
+            changes.append((assignment, "showonlatelist", "True"))
+    store.set_fields("assignments", changes)
     
 
     
@@ -696,54 +1161,33 @@ def select_many_from_list(stuff, resource_name="module"):
 
     return return_items
 
+# all of these read through the userdata store, so the files are only parsed again when they change on disk.
+# What they hand back is shared between callers: don't change it in place (use store.checkout() for that).
 def get_week_names() -> list:
-    with open("./userdata/modules.json", "r") as readfile:
-        modules = json.load(readfile)
-        module_names = list(modules.keys())
-        readfile.close()
-    return module_names
+    return list(store.read("modules").keys())
 
 def get_week_data() -> dict:
-    with open("./userdata/modules.json", "r") as readfile:
-        modules = json.load(readfile)
-        readfile.close()
-    return modules
+    return store.read("modules")
 
 # I'm going to try and make more funcs like this, so we can be more modular.
 def get_assignments() -> dict:
-    with open("./userdata/assignments.json", "r") as file:
-        assignment_dict = json.load(file)
-        file.close()
-    return assignment_dict
+    return store.read("assignments")
 
 def get_assignments_names() -> list:
-    with open("./userdata/assignments.json", "r") as readfile:
-        assignment_dict = json.load(readfile)
-        assignment_names = list(assignment_dict.keys())
-        readfile.close()
-    return assignment_names
+    return list(store.read("assignments").keys())
 
 def get_student_ids() -> list:
-    with open("./userdata/students.json", "r") as readfile:
-        students_dict = json.load(readfile)
-        student_ids = list(students_dict.keys())
-        readfile.close()
-    return student_ids
+    return list(store.read("students").keys())
 
 def get_student_data() -> dict:
-    with open("./userdata/students.json", "r") as readfile:
-        students_dict = json.load(readfile)
-        readfile.close()
-    return students_dict
+    return store.read("students")
 
 def get_config() -> dict:
-    with open("./userdata/config.json", "r") as readfile:
-        config = json.load(readfile)
-        readfile.close()
-    return config
+    return store.read("config")
 
 def get_api_data() -> dict:
-    with open("./userdata/api.json", "r") as file:
-        api_dict = json.load(file)
-        file.close()
-    return api_dict
\ No newline at end of file
+    return store.read("api")
+
+# when each assignment's submissions were last pulled, for incremental syncs. Older setups won't have the file yet.
+def get_sync_state() -> dict:
+    return store.read("sync_state", {})
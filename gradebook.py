@@ -0,0 +1,108 @@
+import csv
+import datetime
+import os
+import re
+
+# reads a gradebook export (Canvas → Grades → Export, like examples/2025-01-26T2144_Grades-*.csv) into the same
+# {assignment name: [missing user ids]} that canvas_api saves in api.json, for when there's no API token or Canvas is
+# down. Nothing here talks to Canvas.
+#
+# every assignment column is headed "<name> (<assignment id>)". The header gets worked out once: each column whose id
+# (or whole header, for older assignments.json entries without an id) is one of our assignments becomes a (position,
+# assignment names, missingif) entry, and everything else (the points, totals, assignments we don't track) is never
+# looked at. Then the file is read a row at a time and each row is only checked at those positions, so nothing but the
+# missing lists grows with the size of the export.
+#
+# an export doesn't have Canvas's missing flag, so "api" assignments count a blank cell as missing once the assignment
+# was due before the export was made. That's Canvas's rule too, except for work that's submitted but not graded yet,
+# which is blank in the export, so grade before exporting. Other missingif values are checked against the cell as text,
+# with the trailing zeros trimmed off both, so a 0 from an older assignments.json ("missingif": 0) matches a "0.00".
+
+ID_SUFFIX = re.compile(r"\((\d+)\)\s*$")
+# the first few columns are about the student, and ID is their Canvas user id
+ID_COLUMN = "ID"
+# the name Canvas gives exports starts with when it was made (local time), like 2025-01-26T2144_Grades-...
+EXPORTED_AT = re.compile(r"(\d{4}-\d{2}-\d{2}T\d{4})")
+
+
+# when the export was made: from its name if it's still the one Canvas gave it, otherwise when the file was saved
+def exported_at(path) -> float:
+    found = EXPORTED_AT.match(os.path.basename(path))
+    if found is not None:
+        return datetime.datetime.strptime(found.group(1), "%Y-%m-%dT%H%M").timestamp()
+    return os.path.getmtime(path)
+
+
+# which columns to read, [(position, [assignment names], missingif as a set, whether a blank counts)], and where the
+# user id is
+def plan_columns(header, assignment_dict, exported) -> tuple:
+    if ID_COLUMN not in header:
+        raise ValueError(f"This doesn't look like a Canvas gradebook export, there's no {ID_COLUMN} column.")
+    by_id = {}
+    by_name = {}
+    for name, info in assignment_dict.items():
+        if info.get("id"):
+            by_id.setdefault(str(info["id"]), []).append(name)
+        else:
+            by_name[name] = [name]
+
+    columns = []
+    for position, title in enumerate(header):
+        found = ID_SUFFIX.search(title)
+        names = by_id.get(found.group(1)) if found is not None else None
+        if names is None:
+            names = by_name.get(title)
+        if names is None:
+            continue
+        for name in names:
+            missingif = assignment_dict[name].get("missingif", "api")
+            if type(missingif) != type([]):
+                missingif = [missingif]
+            blank_missing = "api" in missingif and assignment_dict[name].get("duetimestamp", 0) <= exported
+            criteria = set(grade_text(criterion) for criterion in missingif if criterion != "api")
+            columns.append((position, name, criteria, blank_missing))
+    return header.index(ID_COLUMN), columns
+
+
+# one streaming pass over the export. Hands back the missing lists (only for assignments the export has a column for)
+# and how many students were read.
+def read_missing(path, assignment_dict, exported=None) -> tuple:
+    if exported is None:
+        exported = exported_at(path)
+    with open(path, "r", encoding="utf-8-sig", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"{path} is empty.")
+        id_position, columns = plan_columns(header, assignment_dict, exported)
+        missing_dict = {name: [] for position, name, criteria, blank_missing in columns}
+        # the lists get appended to straight off the plan, no looking names up per cell
+        plan = [(position, missing_dict[name], criteria, blank_missing) for position, name, criteria, blank_missing in columns]
+        width = max([position for position, missing, criteria, blank_missing in plan] + [id_position]) + 1
+
+        students = 0
+        for row in reader:
+            # Points Possible (and any other rows Canvas adds up top) don't have a user id
+            if len(row) <= id_position or not row[id_position].isdigit():
+                continue
+            if len(row) < width:
+                row += [""] * (width - len(row))
+            user_id = int(row[id_position])
+            students += 1
+            for position, missing, criteria, blank_missing in plan:
+                cell = row[position]
+                if cell == "":
+                    if blank_missing:
+                        missing.append(user_id)
+                    continue
+                if criteria and grade_text(cell) in criteria:
+                    missing.append(user_id)
+    return missing_dict, students
+
+
+# scores as text without trailing zeros ("0.00" and 0 are both "0", "8.50" is "8.5"), anything else as is
+def grade_text(value) -> str:
+    value = str(value)
+    if "." in value and value[:1] in "-0123456789":
+        value = value.rstrip("0").rstrip(".")
+    return value
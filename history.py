@@ -0,0 +1,173 @@
+import datetime
+import os
+import sys
+import uuid
+
+import pandas
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
+
+import atomic
+
+# api.json only ever holds the latest pull, so this keeps the history: every submission pull adds a Parquet file to
+# ./userdata/history (HISTORY.path in the config) with what it saw, one row per student per assignment:
+#
+#   run            when the pull started (UTC)
+#   user_id        Canvas user id
+#   assignment_id  Canvas assignment id
+#   missing        whether the tool counted it as missing (the assignment's missingif rules, same as api.json)
+#   grade          Canvas's grade, if there was one
+#
+# only rows that changed since the last time that student/assignment was seen get written, so a semester of daily
+# pulls is mostly the first pull plus whatever changed each day. The columns are dictionary encoded (the same few ids and
+# grades over and over) and zstd compressed, and every so often the run files get folded into one sorted file.
+#
+# the status of anything on a given day is its latest row from on or before that day (as_of), and per student trends
+# come from adding up the changes in order (missing_trend).
+#
+#   python3 history.py as-of 2026-02-01        how many were missing each assignment then
+#   python3 history.py trend <user id>         one student's missing count over the semester
+#   python3 history.py compact                 fold the run files together now
+
+DIRECTORY = "./userdata/history"
+# how many run files to let pile up before folding them into one
+COMPACT_AFTER = 20
+KEY = ["assignment_id", "user_id"]
+
+SCHEMA = pyarrow.schema([("run", pyarrow.timestamp("s", tz="UTC")), ("user_id", pyarrow.int64()),
+                         ("assignment_id", pyarrow.int64()), ("missing", pyarrow.bool_()), ("grade", pyarrow.string())])
+
+
+# saves what a pull saw. rows is (assignment_id, user_id, missing, grade) for every submission it got back; anything
+# the same as its last saved row is dropped. Hands back how many rows were written.
+def append(run, rows, directory=DIRECTORY) -> int:
+    new = pandas.DataFrame(rows, columns=["assignment_id", "user_id", "missing", "grade"])
+    if new.empty:
+        return 0
+    # the same submission can come back twice in one pull (submitted and graded since the last one)
+    new = new.drop_duplicates(KEY, keep="last")
+
+    previous = latest(read(directory, assignment_ids=new["assignment_id"].unique().tolist()))
+    merged = new.merge(previous[KEY+["missing", "grade"]], on=KEY, how="left", suffixes=("", "_before"), indicator=True)
+    same_grade = (merged["grade"] == merged["grade_before"]) | (merged["grade"].isna() & merged["grade_before"].isna())
+    changed = (merged["_merge"] == "left_only") | (merged["missing"] != merged["missing_before"]) | ~same_grade
+    new = merged.loc[changed, ["assignment_id", "user_id", "missing", "grade"]]
+    if new.empty:
+        return 0
+
+    run = timestamp(run)
+    new.insert(0, "run", run)
+    new = new.sort_values(KEY)
+    os.makedirs(directory, exist_ok=True)
+    name = f"run-{run.strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:6]}.parquet"
+    write(pyarrow.Table.from_pandas(new, schema=SCHEMA, preserve_index=False), os.path.join(directory, name))
+
+    if len(run_files(directory)) > COMPACT_AFTER:
+        compact(directory)
+    return len(new)
+
+
+def write(table, path) -> None:
+    # the temp file starts with a . so the readers skip it until it's moved into place
+    with atomic.open_file(path, "wb") as file:
+        pyarrow.parquet.write_table(table, file, compression="zstd", use_dictionary=True)
+
+
+def run_files(directory) -> list:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.startswith("run-") and name.endswith(".parquet"))
+
+
+# folds every file into one, sorted so each student/assignment's rows sit together (which also compresses better)
+def compact(directory=DIRECTORY) -> None:
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".parquet") and not name.startswith((".", "_")))
+    if len(names) < 2:
+        return
+    table = read(directory).sort_by([("assignment_id", "ascending"), ("user_id", "ascending"), ("run", "ascending")])
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    write(table, os.path.join(directory, f"history-{stamp}-{uuid.uuid4().hex[:6]}.parquet"))
+    # if we die before these are gone, the rows are just there twice, which latest() doesn't mind
+    for name in names:
+        os.remove(os.path.join(directory, name))
+
+
+# every saved row, narrowed down to some assignments/students and to rows from on or before until
+def read(directory=DIRECTORY, assignment_ids=None, user_ids=None, until=None) -> pyarrow.Table:
+    if not os.path.isdir(directory) or not any(name.endswith(".parquet") for name in os.listdir(directory)):
+        return SCHEMA.empty_table()
+    dataset = pyarrow.dataset.dataset(directory, format="parquet", schema=SCHEMA)
+    condition = None
+    if assignment_ids is not None:
+        condition = pyarrow.dataset.field("assignment_id").isin(list(assignment_ids))
+    if user_ids is not None:
+        narrowed = pyarrow.dataset.field("user_id").isin(list(user_ids))
+        condition = narrowed if condition is None else condition & narrowed
+    if until is not None:
+        before = pyarrow.dataset.field("run") <= pyarrow.scalar(timestamp(until), type=SCHEMA.field("run").type)
+        condition = before if condition is None else condition & before
+    return dataset.to_table(filter=condition)
+
+
+# the last row for each student/assignment
+def latest(table) -> pandas.DataFrame:
+    frame = table.to_pandas()
+    return frame.sort_values("run", kind="stable").drop_duplicates(KEY, keep="last").reset_index(drop=True)
+
+
+# where everything stood at a point in time (anything datetime-like, or a string like "2026-02-01"; dates without a
+# timezone are taken as UTC, and a bare date means the end of that day)
+def as_of(when, directory=DIRECTORY, assignment_ids=None, user_ids=None) -> pandas.DataFrame:
+    return latest(read(directory, assignment_ids, user_ids, until=when))
+
+
+# as_of, shaped like api.json: assignment id -> the user ids that were missing it
+def missing_as_of(when, directory=DIRECTORY, assignment_ids=None) -> dict:
+    frame = as_of(when, directory, assignment_ids)
+    frame = frame[frame["missing"]].sort_values(KEY)
+    return {int(assignment_id): group["user_id"].tolist() for assignment_id, group in frame.groupby("assignment_id")}
+
+
+# how many assignments each student was missing after every pull that changed something for them: columns
+# user_id, run, missing
+def missing_trend(directory=DIRECTORY, user_ids=None, assignment_ids=None) -> pandas.DataFrame:
+    frame = read(directory, assignment_ids, user_ids).to_pandas()
+    if frame.empty:
+        return pandas.DataFrame({"user_id":pandas.Series(dtype="int64"), "run":pandas.Series(dtype="datetime64[s, UTC]"),
+                                 "missing":pandas.Series(dtype="int64")})
+    frame = frame.sort_values(["user_id", "assignment_id", "run"], kind="stable")
+    # each row changes the count by +1 (now missing), -1 (not anymore) or 0
+    before = frame.groupby(KEY)["missing"].shift(1, fill_value=False).astype("int64")
+    frame["change"] = frame["missing"].astype("int64") - before
+    changes = frame.groupby(["user_id", "run"])["change"].sum()
+    trend = changes.groupby(level="user_id").cumsum().rename("missing").reset_index()
+    return trend
+
+
+def timestamp(when):
+    if isinstance(when, str) and len(when) == 10:
+        # a bare date covers the whole day
+        when = pandas.Timestamp(when) + pandas.Timedelta(days=1) - pandas.Timedelta(seconds=1)
+    when = pandas.Timestamp(when).floor("s")
+    return when.tz_localize("UTC") if when.tzinfo is None else when.tz_convert("UTC")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ["as-of", "trend", "compact"]:
+        print("usage: python history.py as-of <date> | trend <user id> | compact")
+        sys.exit(1)
+    abspath = os.path.abspath(__file__)
+    os.chdir(os.path.dirname(abspath))
+    from userdata_store import store
+    directory = store.read("config").get("HISTORY", {}).get("path", DIRECTORY)
+
+    if sys.argv[1] == "as-of":
+        names = {assignment["id"]: name for name, assignment in store.read("assignments", {}).items()}
+        for assignment_id, users in missing_as_of(sys.argv[2], directory).items():
+            print(f"{len(users):5d} missing  {names.get(assignment_id, assignment_id)}")
+    elif sys.argv[1] == "trend":
+        for row in missing_trend(directory, user_ids=[int(sys.argv[2])]).itertuples():
+            print(f"{row.run:%Y-%m-%d %H:%M}  {row.missing} missing")
+    else:
+        compact(directory)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import atomic
+
+# a small on-disk cache for Canvas responses that don't change much (the assignment and module lists). We keep the body
+# along with the ETag/Last-Modified Canvas sent, and send those back next time. If nothing changed Canvas answers with
+# an empty 304 and we hand back the saved copy instead of downloading the whole thing again.
+#
+# everything lives in one folder: index.json tracks what's cached, and each response body sits in its own file.
+# When the bodies go over max_bytes, the ones used longest ago get thrown out.
+
+# headers we hold onto so a cached response still behaves like the real one (pagination lives in Link)
+KEPT_HEADERS = ["Content-Type", "Link", "ETag", "Last-Modified"]
+
+
+class ResponseCache:
+
+    def __init__(self, directory="./userdata/http_cache", max_bytes=50*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = None
+
+    # the cache key is the full url plus the query, sorted so the same request always lands in the same place
+    def key(self, url, params=None) -> str:
+        if params is None:
+            params = []
+        elif isinstance(params, dict):
+            params = list(params.items())
+        query = "&".join(f"{name}={value}" for name, value in sorted((str(n), str(v)) for n, v in params))
+        return hashlib.sha256((url+"?"+query).encode("utf-8")).hexdigest()
+
+    # the headers to make a request conditional on what we have saved. Empty if we have nothing.
+    def conditional_headers(self, key) -> dict:
+        with self.lock:
+            entry = self.load_index().get(key)
+        headers = {}
+        if entry is None:
+            return headers
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    # Canvas said nothing changed (304), so rebuild the response we saved. Returns None if the saved body went missing.
+    def hit(self, key, url):
+        with self.lock:
+            index = self.load_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            try:
+                with open(self.body_path(key), "rb") as file:
+                    body = file.read()
+            except FileNotFoundError:
+                del index[key]
+                self.save_index()
+                return None
+            entry["used"] = time.time()
+            self.save_index()
+
+        r = requests.Response()
+        r.status_code = 200
+        r._content = body
+        r.headers = CaseInsensitiveDict(entry["headers"])
+        r.url = url
+        r.encoding = "utf-8"
+        return r
+
+    # saves a fresh 200 if Canvas gave us something to validate it with next time.
+    def store(self, key, url, r) -> None:
+        if r.status_code != 200 or ("ETag" not in r.headers and "Last-Modified" not in r.headers):
+            return
+        if len(r.content) > self.max_bytes:
+            return
+        headers = {}
+        for header in KEPT_HEADERS:
+            if header in r.headers:
+                headers[header] = r.headers[header]
+
+        with self.lock:
+            index = self.load_index()
+            atomic.write_bytes(self.body_path(key), r.content)
+            index[key] = {"url":url, "headers":headers, "size":len(r.content), "used":time.time()}
+            self.evict()
+            self.save_index()
+
+    # throws out the least recently used bodies until we're back under max_bytes. Caller holds the lock.
+    def evict(self) -> None:
+        index = self.index
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["used"]):
+            if total <= self.max_bytes:
+                break
+            total -= index[key]["size"]
+            del index[key]
+            try:
+                os.remove(self.body_path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        with self.lock:
+            for key in list(self.load_index()):
+                try:
+                    os.remove(self.body_path(key))
+                except FileNotFoundError:
+                    pass
+            self.index = {}
+            self.save_index()
+
+    def body_path(self, key) -> str:
+        return os.path.join(self.directory, key+".body")
+
+    # caller holds the lock for both of these
+    def load_index(self) -> dict:
+        if self.index is None:
+            try:
+                with open(os.path.join(self.directory, "index.json"), "r") as file:
+                    self.index = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.index = {}
+        return self.index
+
+    def save_index(self) -> None:
+        atomic.write_bytes(os.path.join(self.directory, "index.json"), json.dumps(self.index, indent=4).encode("utf-8"))
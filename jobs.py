@@ -0,0 +1,151 @@
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import sync_metrics
+
+# long running work (Canvas syncs, making the report) for the Streamlit app. Jobs run on a small pool of background
+# threads so the page stays usable, and they're kept per process, not per browser session: if a TA hits Run on
+# something that's already running (or just finished, see submit) for someone else, they get that job instead of
+# starting another sync.
+#
+# everything a job prints goes to its own log instead of the terminal. sys.stdout gets swapped for a router that
+# looks up which job the printing thread belongs to; thread pools a job starts pick that up through adopt_log()
+# (funcs.request_pool does this).
+
+# how many jobs can run at once. They all share the one Canvas rate limit, so more doesn't help much.
+MAX_WORKERS = 2
+# how many lines of each job's output to hold onto
+LOG_LINES = 2000
+
+local = threading.local()
+
+
+# the output of one job, a line at a time
+class JobLog:
+
+    def __init__(self):
+        self.lines = []
+        self.partial = ""
+        self.lock = threading.Lock()
+
+    def write(self, text) -> int:
+        with self.lock:
+            lines = (self.partial+text).split("\n")
+            self.partial = lines.pop()
+            self.lines += lines
+            if len(self.lines) > LOG_LINES:
+                del self.lines[:len(self.lines)-LOG_LINES]
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def text(self, last=None) -> str:
+        with self.lock:
+            lines = self.lines + ([self.partial] if self.partial else [])
+        if last is not None:
+            lines = lines[-last:]
+        return "\n".join(lines)
+
+
+# stands in for sys.stdout. Writes from a job's threads go to the job's log, everything else goes where it always did.
+class LogRouter:
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def write(self, text):
+        log = current_log()
+        return (log if log is not None else self.fallback).write(text)
+
+    def flush(self):
+        log = current_log()
+        (log if log is not None else self.fallback).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+def current_log():
+    return getattr(local, "log", None)
+
+
+def adopt_log(log) -> None:
+    local.log = log
+
+
+def install_router() -> None:
+    if not isinstance(sys.stdout, LogRouter):
+        sys.stdout = LogRouter(sys.stdout)
+
+
+class Job:
+
+    def __init__(self, key, name):
+        self.key = key
+        self.name = name
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.result = None
+        self.metrics = None
+        self.log = JobLog()
+        self.done = 0
+        self.total = 0
+
+    def progress(self, done, total, label) -> None:
+        self.done, self.total = done, total
+
+    def running(self) -> bool:
+        return self.status in ["queued", "running"]
+
+
+jobs = {}
+jobs_lock = threading.Lock()
+pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+
+
+# starts func(*args) in the background under key, unless a job with that key is already running, or finished less
+# than fresh_for seconds ago, in which case that one is handed back instead. Returns (job, whether it's a new one).
+def submit(key, name, func, *args, fresh_for=0):
+    with jobs_lock:
+        job = jobs.get(key)
+        if job is not None:
+            if job.running():
+                return job, False
+            if fresh_for > 0 and job.finished is not None and time.time() - job.finished < fresh_for:
+                return job, False
+        job = Job(key, name)
+        jobs[key] = job
+    install_router()
+    pool.submit(run, job, func, args)
+    return job, True
+
+
+def run(job, func, args) -> None:
+    adopt_log(job.log)
+    job.status = "running"
+    job.started = time.time()
+    try:
+        with sync_metrics.track(job.name, progress=job.progress) as metrics:
+            job.metrics = metrics
+            job.result = func(*args)
+        job.status = "done"
+    except Exception as e:
+        traceback.print_exc(file=job.log)
+        job.error = str(e) or type(e).__name__
+        job.status = "failed"
+    finally:
+        job.finished = time.time()
+        adopt_log(None)
+
+
+# the most recent job for a key, if there's been one
+def latest(key):
+    with jobs_lock:
+        return jobs.get(key)
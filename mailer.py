@@ -0,0 +1,248 @@
+import concurrent.futures
+import json
+import os
+import random
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+import sync_metrics
+
+# sends the report straight to the students instead of handing the CSV to a mail merge. Each row of the export gets
+# rendered into the email template (see email_template.py) and sent over SMTP.
+#
+# messages go out in batches over a few SMTP connections that stay open for the whole run (one per worker thread), so
+# we aren't logging in to the mail server for every student. Each connection waits batch_pause seconds between
+# batches, and per_minute caps how fast the whole pool goes, since most mail servers have a sending limit.
+#
+# every message the server accepts gets written down in the send log (./userdata/send_log.jsonl) right away, and
+# anything already in there for that module is skipped, so if a run dies partway through, running it again picks up
+# where it left off instead of sending everyone their report twice. Failures aren't logged, so they get tried again
+# on the next run. To send a module again on purpose, delete its lines from the log.
+#
+# mock_smtp.py is a local mail server to try this out against.
+
+# config['EMAIL'], with these filling in anything it leaves out
+DEFAULTS = {"host":"localhost", "port":25, "security":"none", "username":"", "password":"", "from":"", "reply_to":"",
+            "template":"./userdata/email_template.txt", "connections":3, "batch_size":50, "batch_pause":1.0,
+            "per_minute":0, "retries":2, "timeout":30, "log":"./userdata/send_log.jsonl"}
+
+
+def get_settings(config) -> dict:
+    settings = dict(DEFAULTS)
+    settings.update(config.get("EMAIL", {}))
+    return settings
+
+
+def as_text(reply) -> str:
+    return reply.decode(errors="replace") if isinstance(reply, bytes) else str(reply)
+
+
+# renderer is the template bound to the report's header (email_template.Renderer), row one student's row of it
+def build_message(renderer, row, to, settings) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = renderer.subject(row)
+    # saving the emails as files (funcs.save_emails) doesn't need a sender
+    if settings["from"]:
+        message["From"] = settings["from"]
+    message["To"] = to
+    if settings["reply_to"]:
+        message["Reply-To"] = settings["reply_to"]
+    message["Date"] = formatdate(localtime=True)
+    domain = settings["from"].rsplit("@", 1)[-1].strip("> ") if "@" in settings["from"] else None
+    message["Message-ID"] = make_msgid(domain=domain)
+    message.set_content(renderer.body(row))
+    return message
+
+
+# who's already gotten which module, so a rerun doesn't send them another copy
+class SendLog:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def sent(self, report) -> set:
+        recipients = set()
+        if not os.path.exists(self.path):
+            return recipients
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line can be cut off if we died while writing it
+                    continue
+                if entry.get("report") == report:
+                    recipients.add(entry["to"])
+        return recipients
+
+    def record(self, report, to, message_id) -> None:
+        line = json.dumps({"report":report, "to":to, "message_id":message_id,
+                           "sent":time.strftime("%Y-%m-%dT%H:%M:%S")})+"\n"
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line)
+            self.file.flush()
+
+    # makes sure everything written so far is actually on disk (done after every batch)
+    def sync(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class Mailer:
+
+    def __init__(self, settings, send_log, report):
+        self.settings = settings
+        self.send_log = send_log
+        self.report = report
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.counts = {"sent":0, "failed":0}
+        self.failures = []
+        self.stopped = False
+
+    # this thread's connection, opened (and logged in) the first time it's needed
+    def connection(self):
+        smtp = getattr(self.local, "smtp", None)
+        if smtp is None:
+            settings = self.settings
+            if settings["security"] == "ssl":
+                smtp = smtplib.SMTP_SSL(settings["host"], int(settings["port"]), timeout=settings["timeout"])
+            else:
+                smtp = smtplib.SMTP(settings["host"], int(settings["port"]), timeout=settings["timeout"])
+                if settings["security"] == "starttls":
+                    smtp.starttls()
+            if settings["username"]:
+                smtp.login(settings["username"], settings["password"])
+            self.local.smtp = smtp
+            with self.lock:
+                self.connections.append(smtp)
+        return smtp
+
+    def drop(self) -> None:
+        smtp = getattr(self.local, "smtp", None)
+        self.local.smtp = None
+        if smtp is not None:
+            with self.lock:
+                self.connections.remove(smtp)
+            try:
+                smtp.close()
+            except OSError:
+                pass
+
+    # holds the message back until the pool is under per_minute
+    def pace(self) -> None:
+        per_minute = float(self.settings["per_minute"])
+        if per_minute <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 60/per_minute
+        if slot > now:
+            time.sleep(slot-now)
+
+    # sends one batch of (to, message) over this thread's connection
+    def send_batch(self, batch) -> None:
+        for to, message in batch:
+            if self.stopped:
+                return
+            self.send_one(to, message)
+            sync_metrics.advance(to)
+        self.send_log.sync()
+        time.sleep(float(self.settings["batch_pause"]))
+
+    def send_one(self, to, message) -> None:
+        retries = int(self.settings["retries"])
+        for attempt in range(retries+1):
+            self.pace()
+            try:
+                smtp = self.connection()
+            except (smtplib.SMTPException, OSError) as e:
+                # if we can't get in at all (wrong host, password, ...) every other message is going to fail the same way
+                self.stopped = True
+                raise ConnectionError(f"Couldn't connect to the mail server at {self.settings['host']}:"
+                                      f"{self.settings['port']}: {e}") from e
+            try:
+                smtp.send_message(message, to_addrs=[to])
+            except smtplib.SMTPRecipientsRefused as e:
+                code, reason = list(e.recipients.values())[0]
+                error = f"{code} {as_text(reason)}"
+                if code >= 500:
+                    break
+            except smtplib.SMTPResponseException as e:
+                error = f"{e.smtp_code} {as_text(e.smtp_error)}"
+                # 421 is the server closing the connection on us (often a messages per connection limit)
+                if e.smtp_code == 421:
+                    self.drop()
+                    continue
+                # other 4xx means try again later, 5xx means it's never going to work
+                if e.smtp_code >= 500:
+                    break
+            except (smtplib.SMTPException, OSError) as e:
+                # the connection went bad (servers hang up on idle or long lived connections), start a new one
+                self.drop()
+                error = f"{type(e).__name__}: {e}"
+                continue
+            else:
+                self.send_log.record(self.report, to, message["Message-ID"])
+                with self.lock:
+                    self.counts["sent"] += 1
+                return
+            time.sleep(random.uniform(0.5, 1.0) * (attempt+1))
+        print(f"Couldn't send to {to}: {error}")
+        with self.lock:
+            self.counts["failed"] += 1
+            self.failures.append((to, error))
+
+    def close(self) -> None:
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for smtp in connections:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+# sends every (to, message) that isn't in the send log for this report yet, batch_size at a time on the pool's threads
+# (one SMTP connection each). pool should have settings["connections"] workers.
+def send_all(messages, settings, report, pool) -> dict:
+    send_log = SendLog(settings["log"])
+    already = send_log.sent(report)
+    pending = [(to, message) for to, message in messages if to not in already]
+    skipped = len(messages) - len(pending)
+    if skipped:
+        print(f"{skipped} of {len(messages)} already got {report} (see {settings['log']}), skipping them.")
+
+    batch_size = max(1, int(settings["batch_size"]))
+    batches = [pending[start:start+batch_size] for start in range(0, len(pending), batch_size)]
+    sync_metrics.plan(len(pending))
+    mailer = Mailer(settings, send_log, report)
+    try:
+        futures = [pool.submit(mailer.send_batch, batch) for batch in batches]
+        # let every batch finish (or notice we've stopped) before closing the connections out from under them
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+    finally:
+        mailer.close()
+        send_log.close()
+    return {"sent":mailer.counts["sent"], "failed":mailer.counts["failed"], "skipped":skipped,
+            "failures":mailer.failures}
@@ -1,6 +1,7 @@
 import funcs
 import os
 import time
+import sync_metrics
 
 run = True
 
@@ -11,6 +12,16 @@ else:
 
 feedback = ''
 
+# prints how far along a Canvas pull is (in requests) every 10% or so, in between the page by page output
+def progress_printer(what="Canvas requests"):
+    shown = {"step":-1}
+    def show(done, total, label):
+        step = int(done / total * 10) if total else 0
+        if done > 0 and step != shown["step"]:
+            shown["step"] = step
+            print(f"--- {done} of {total} {what} done ({done*100//total}%) ---")
+    return show
+
 # this is the most basic thing, but it just runs a interactive terminal thing for the tool. We can interact with any supporting functions from funcs, 
 # but use this file to write software logic.
 while run:
@@ -20,20 +31,27 @@ while run:
     1) Get Course Student List \t\t 2) Get Course Assignments
     3) Pull Current Assignment Details \t 4) Check Files (Deprecated)
     5) Make Emails \t\t\t 6) Exit
-    7) Combine/Rename Modules""")
+    7) Combine/Rename Modules \t\t 9) Pull Assignment Changes Since Last Pull
+    10) Run Every Course in the Batch List \t 11) Make Emails for Every Module
+    12) Send Emails \t\t\t 13) Save Emails as Files
+    14) Class Analytics for a Module \t 15) Import a Gradebook Export (Offline)""")
     command = int(input())
     match command:
         case 0:
             funcs.setup_data(["config","assignments","modules","api", "students"])
             feedback = 'Successfully set up user data!'
         case 1:
-            funcs.get_students()
+            with sync_metrics.track("get_students", progress=progress_printer()):
+                funcs.get_students()
             feedback = 'Successfully pulled student data!'
         case 2:
-            funcs.api_scrape()
+            with sync_metrics.track("api_scrape", progress=progress_printer()):
+                funcs.api_scrape()
             feedback = 'Successfully pulled assignment data!'
         case 3:
-            funcs.canvas_api(funcs.select_one_from_list(funcs.get_week_names()))
+            week = funcs.select_one_from_list(funcs.get_week_names())
+            with sync_metrics.track("canvas_api", progress=progress_printer()):
+                funcs.canvas_api(week)
             feedback = 'Successfully pulled submission data!'
         case 4:
             funcs.check()
@@ -49,6 +67,34 @@ while run:
         case 8:
             funcs.change_late_list(funcs.select_one_from_list(funcs.get_week_names()))
             feedback = ""
+        case 9:
+            week = funcs.select_one_from_list(funcs.get_week_names())
+            with sync_metrics.track("canvas_api", progress=progress_printer()):
+                funcs.canvas_api(week, incremental=True)
+            feedback = 'Successfully pulled submission changes!'
+        case 10:
+            import batch
+            batch.run_batch()
+            feedback = 'Finished the batch run, see above for each course!'
+        case 11:
+            funcs.make_all_emails()
+            feedback = 'Successfully made every module\'s email in ./exports!'
+        case 12:
+            week = funcs.select_one_from_list(funcs.get_week_names())
+            with sync_metrics.track("send_emails", progress=progress_printer("emails")):
+                funcs.send_emails(week)
+            feedback = 'Finished sending, see above for how it went!'
+        case 13:
+            week = funcs.select_one_from_list(funcs.get_week_names())
+            kind = funcs.select_one_from_list(["a folder of .eml files", "one mbox file"], "format")
+            funcs.save_emails(week, mbox=(kind == "one mbox file"))
+            feedback = 'Successfully saved the emails in ./exports!'
+        case 14:
+            funcs.make_analytics(funcs.select_one_from_list(funcs.get_week_names()))
+            feedback = 'Successfully made the analytics in ./exports!'
+        case 15:
+            funcs.import_gradebook(input("\nPath to the gradebook export (.csv): ").strip().strip('"'))
+            feedback = 'Successfully imported the gradebook into the api data!'
         case 20:
             funcs.canvas_assignment_dump()
             feedback = 'DEBUG: Canvas export made in ./userdata!'
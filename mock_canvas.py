@@ -0,0 +1,363 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import synthetic_course
+
+# a stand-in for Canvas that runs on your own machine, serving made up courses (synthetic_course.py) through the same
+# endpoints the tool uses. Point API.base_url at it to try out pulls, throughput and the retry/backoff code without
+# touching the real Canvas:
+#
+#   python3 mock_canvas.py --students 2000 --latency 0.05 --bucket 700 --cost 50 --refill 100
+#   "base_url": "http://127.0.0.1:8700/api/v1/"
+#
+# any course id works (each one gets its own course, the same every time) and any Bearer token is accepted.
+#
+# what it serves, under /api/v1/courses/<course>/:
+#   users                        the students, filtered by enrollment_type[]
+#   sections
+#   enrollments                  filtered by type[], paged with bookmarks like Canvas does
+#   assignments                  with ETags, so cached requests get 304s
+#   modules                      with ETags, include[]=items lists each module's items (left out for big modules,
+#                                like Canvas does, which then have to be asked for through items_url)
+#   modules/<id>/items
+#   assignments/<id>/submissions include[]=submission_history makes the pages as heavy as Canvas's (lean pulls skip it)
+#   students/submissions         assignment_ids[], submitted_since and graded_since
+#
+# lists are paged per_page at a time (100 max) with Link headers. Every response goes out after --latency seconds
+# (plus up to --jitter more). Throttling comes in two flavors: --bucket turns on a Canvas-style rate limit where each
+# request costs --cost out of the bucket, which refills at --refill per second, and an empty bucket gets a 403 "Rate
+# Limit Exceeded"; --throttle-rate throws the same 403 at a random fraction of requests no matter what.
+#
+# and a few for whoever is testing:
+#   /mock/stats               requests, throttles, 304s and bytes so far, by endpoint
+#   /mock/reset               zeroes the stats
+#   /mock/change?course=<id>&count=<n>
+#                             re-grades n random submissions right now, so incremental pulls have something to find
+
+PER_PAGE_MAX = 100
+# modules with more items than this leave them out of include[]=items
+MODULE_ITEMS_INLINE = 50
+
+
+class MockCanvas:
+
+    def __init__(self, students=1000, assignments=60, modules=12, missing_rate=0.15, seed=0, latency=0.0, jitter=0.0,
+                 bucket=0.0, cost=50.0, refill=100.0, throttle_rate=0.0, retry_after=None):
+        self.sizes = {"students":students, "assignments":assignments, "modules":modules, "missing_rate":missing_rate}
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = bucket
+        self.cost = cost
+        self.refill = refill
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+        self.courses = {}
+        self.submissions = {}
+        self.level = bucket
+        self.stamp = time.monotonic()
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.rnd = random.Random(seed)
+
+    # every course id gets its own course, made the first time it's asked for
+    def course(self, course_id):
+        with self.lock:
+            if course_id not in self.courses:
+                seed = self.seed*1000003 + zlib.crc32(course_id.encode())
+                self.courses[course_id] = synthetic_course.make_course(seed=seed, **self.sizes)
+            return self.courses[course_id]
+
+    # submissions are made once per assignment and then kept, so /mock/change has something to change
+    def assignment_submissions(self, course_id, assignment):
+        key = (course_id, assignment["id"])
+        with self.lock:
+            if key not in self.submissions:
+                self.submissions[key] = synthetic_course.make_submissions(self.courses[course_id], assignment)
+            return self.submissions[key]
+
+    # takes a request's cost out of the bucket. False means it's empty and the request gets throttled.
+    def draw(self) -> bool:
+        if self.bucket <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.bucket, self.level + (now - self.stamp) * self.refill)
+            self.stamp = now
+            if self.level < self.cost:
+                return False
+            self.level -= self.cost
+            return True
+
+    def remaining(self) -> float:
+        if self.bucket <= 0:
+            return 700.0
+        with self.lock:
+            return max(0.0, self.level)
+
+    def count(self, endpoint, field, amount=1) -> None:
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {"requests":0, "throttled":0, "not_modified":0, "bytes":0})
+            stats[field] += amount
+
+    def change(self, course_id, count) -> int:
+        course = self.course(course_id)
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        changed = 0
+        for _ in range(count):
+            assignment = self.rnd.choice(course["assignments"])
+            submission = self.rnd.choice(self.assignment_submissions(course_id, assignment))
+            with self.lock:
+                # missing ones get turned in, and turned in ones get a new grade
+                if submission["missing"] or submission["grade"] in [None, "0"]:
+                    submission.update({"missing":False, "grade":"10", "workflow_state":"graded", "submitted_at":now})
+                else:
+                    submission["grade"] = str(self.rnd.randrange(6, 11))
+                submission["graded_at"] = now
+            changed += 1
+        return changed
+
+
+class MockCanvasHandler(BaseHTTPRequestHandler):
+    # keep-alive, so the client's connection pool gets used like it would against Canvas
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        mock = self.server.mock
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.startswith("/mock/"):
+            return self.mock_command(mock, url.path, query)
+
+        match = re.match(r"^/api/v1/courses/([^/]+)/(.+?)/?$", url.path)
+        endpoint = endpoint_name(match.group(2)) if match else "unknown"
+        mock.count(endpoint, "requests")
+
+        delay = mock.latency + (random.uniform(0, mock.jitter) if mock.jitter > 0 else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.send_json(401, {"errors":[{"message":"user authorization required"}]}, endpoint)
+        if (mock.throttle_rate > 0 and random.random() < mock.throttle_rate) or not mock.draw():
+            mock.count(endpoint, "throttled")
+            headers = {"X-Rate-Limit-Remaining":"0.0"}
+            if mock.retry_after is not None:
+                headers["Retry-After"] = str(mock.retry_after)
+            return self.send_text(403, "403 Forbidden (Rate Limit Exceeded)\n", endpoint, headers)
+        if match is None:
+            return self.send_json(404, {"errors":[{"message":"The specified resource does not exist."}]}, endpoint)
+
+        course_id, resource = match.group(1), match.group(2).strip("/")
+        course = mock.course(course_id)
+        records = self.resource(mock, course_id, course, resource, query)
+        if records is None:
+            return self.send_json(404, {"errors":[{"message":"The specified resource does not exist."}]}, endpoint)
+
+        per_page = max(1, min(PER_PAGE_MAX, int(first(query, "per_page", 10))))
+        bookmarks = endpoint == "enrollments"
+        if bookmarks:
+            page = first(query, "page", "")
+            start = int(base64.urlsafe_b64decode(page[len("bookmark:"):]).decode()) if page.startswith("bookmark:") else 0
+        else:
+            start = (max(1, int(first(query, "page", 1))) - 1) * per_page
+        chunk = records[start:start+per_page]
+
+        links = {}
+        if start + per_page < len(records):
+            if bookmarks:
+                links["next"] = "bookmark:"+base64.urlsafe_b64encode(str(start+per_page).encode()).decode()
+            else:
+                links["next"] = start // per_page + 2
+        # Canvas leaves out the last page when counting would be expensive (bookmarks and the bulk endpoint)
+        if not bookmarks and endpoint != "students/submissions":
+            links["first"] = 1
+            links["last"] = max(1, -(-len(records) // per_page))
+        headers = {"Link":self.link_header(url, query, links)} if links else {}
+
+        body = json.dumps(chunk).encode()
+        if endpoint in ["assignments", "modules", "sections", "users"]:
+            etag = '"'+hashlib.md5(body).hexdigest()+'"'
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                mock.count(endpoint, "not_modified")
+                return self.send_body(304, b"", endpoint, headers)
+        return self.send_body(200, body, endpoint, headers, "application/json; charset=utf-8")
+
+    # the full list for a request, before paging. None for anything we don't serve.
+    def resource(self, mock, course_id, course, resource, query):
+        if resource == "sections":
+            return course["sections"]
+
+        if resource == "enrollments":
+            types = query.get("type[]", [])
+            return [enrollment for enrollment in course["enrollments"] if types == [] or enrollment["role"] in types]
+
+        if resource == "users":
+            # only students are in the made up courses, so any other enrollment_type[] comes back empty
+            types = query.get("enrollment_type[]", [])
+            if types != [] and "student" not in types:
+                return []
+            users = {}
+            for enrollment in course["enrollments"]:
+                user = enrollment["user"]
+                users[user["id"]] = {"id":user["id"], "name":" ".join(reversed(user["sortable_name"].split(", "))),
+                                     "sortable_name":user["sortable_name"], "login_id":user["login_id"]}
+            return list(users.values())
+
+        if resource == "assignments":
+            return course["assignments"]
+
+        if resource == "modules":
+            modules = []
+            for position, module in enumerate(course["modules"]):
+                items = synthetic_course.module_items(course, module)
+                module = dict(module, position=position+1, items_count=len(items),
+                              items_url=f"http://{self.headers.get('Host', '127.0.0.1')}/api/v1/courses/{course_id}/modules/{module['id']}/items")
+                if "items" in query.get("include[]", []) and len(items) <= MODULE_ITEMS_INLINE:
+                    module["items"] = items
+                modules.append(module)
+            return modules
+
+        match = re.match(r"^modules/([0-9]+)/items$", resource)
+        if match:
+            module = next((item for item in course["modules"] if str(item["id"]) == match.group(1)), None)
+            return None if module is None else synthetic_course.module_items(course, module)
+
+        match = re.match(r"^assignments/([0-9]+)/submissions$", resource)
+        if match:
+            assignment = next((item for item in course["assignments"] if str(item["id"]) == match.group(1)), None)
+            if assignment is None:
+                return None
+            return with_history(mock.assignment_submissions(course_id, assignment), query)
+
+        if resource == "students/submissions":
+            ids = set(query.get("assignment_ids[]", []))
+            submitted_since = first(query, "submitted_since", None)
+            graded_since = first(query, "graded_since", None)
+            submissions = []
+            for assignment in course["assignments"]:
+                if ids and str(assignment["id"]) not in ids:
+                    continue
+                for submission in mock.assignment_submissions(course_id, assignment):
+                    # the timestamps are all the same format, so comparing the strings works
+                    if submitted_since is not None and (submission["submitted_at"] or "") < submitted_since:
+                        continue
+                    if graded_since is not None and (submission["graded_at"] or "") < graded_since:
+                        continue
+                    submissions.append(submission)
+            return with_history(submissions, query)
+
+        return None
+
+    def link_header(self, url, query, links) -> str:
+        base = f"http://{self.headers.get('Host', '127.0.0.1')}{url.path}"
+        params = [(key, value) for key, values in query.items() if key != "page" for value in values]
+        parts = []
+        for rel, page in links.items():
+            parts.append(f'<{base}?{urlencode(params+[("page", page)])}>; rel="{rel}"')
+        return ",".join(parts)
+
+    def mock_command(self, mock, path, query):
+        if path == "/mock/stats":
+            with mock.lock:
+                stats = json.loads(json.dumps(mock.stats))
+            return self.send_json(200, stats, None)
+        if path == "/mock/reset":
+            with mock.lock:
+                mock.stats = {}
+            return self.send_json(200, {"reset":True}, None)
+        if path == "/mock/change":
+            changed = mock.change(first(query, "course", "1"), int(first(query, "count", 1)))
+            return self.send_json(200, {"changed":changed}, None)
+        return self.send_json(404, {"errors":[{"message":"no such mock command"}]}, None)
+
+    def send_json(self, status, data, endpoint, headers=None):
+        return self.send_body(status, json.dumps(data).encode(), endpoint, headers, "application/json; charset=utf-8")
+
+    def send_text(self, status, text, endpoint, headers=None):
+        return self.send_body(status, text.encode(), endpoint, headers, "text/plain; charset=utf-8")
+
+    def send_body(self, status, body, endpoint, headers=None, content_type=None):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        headers = {"X-Rate-Limit-Remaining":f"{self.server.mock.remaining():.1f}", **(headers or {})}
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if endpoint is not None:
+            self.server.mock.count(endpoint, "bytes", len(body))
+
+
+# groups the request paths the way the stats are kept ("assignments/123/submissions" -> "assignments/:id/submissions")
+def endpoint_name(resource) -> str:
+    return re.sub(r"/[0-9]+/", "/:id/", resource.strip("/")+"/").strip("/")
+
+
+def first(query, key, default):
+    return query.get(key, [default])[0]
+
+
+# Canvas sends back every past version of a submission with include[]=submission_history, which is most of the page
+def with_history(submissions, query) -> list:
+    if "submission_history" not in query.get("include[]", []):
+        return submissions
+    return [dict(submission, submission_history=[dict(submission)]) for submission in submissions]
+
+
+# starts the server on a background thread (for scripts that want it running alongside the tool). Port 0 picks a free
+# one; the base url to hand the tool is "http://127.0.0.1:<server.server_port>/api/v1/".
+def start(port=8700, host="127.0.0.1", **settings):
+    server = ThreadingHTTPServer((host, port), MockCanvasHandler)
+    server.daemon_threads = True
+    server.mock = MockCanvas(**settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A local stand-in for the Canvas API, serving made up courses.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--assignments", type=int, default=60)
+    parser.add_argument("--modules", type=int, default=12)
+    parser.add_argument("--missing-rate", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--bucket", type=float, default=0.0, help="rate limit bucket size (0 turns the limit off)")
+    parser.add_argument("--cost", type=float, default=50.0, help="how much each request takes out of the bucket")
+    parser.add_argument("--refill", type=float, default=100.0, help="how much the bucket refills per second")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests to throttle at random")
+    parser.add_argument("--retry-after", type=float, default=None, help="send a Retry-After (seconds) with throttles")
+    args = parser.parse_args()
+
+    server = start(args.port, args.host, students=args.students, assignments=args.assignments, modules=args.modules,
+                   missing_rate=args.missing_rate, seed=args.seed, latency=args.latency, jitter=args.jitter,
+                   bucket=args.bucket, cost=args.cost, refill=args.refill, throttle_rate=args.throttle_rate,
+                   retry_after=args.retry_after)
+    print(f"Mock Canvas running, set base_url to http://{args.host}:{server.server_port}/api/v1/ (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(server.mock.stats, indent=4))
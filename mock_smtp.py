@@ -0,0 +1,184 @@
+import argparse
+import base64
+import json
+import os
+import random
+import socketserver
+import threading
+import time
+
+# a stand-in mail server that runs on your own machine, for trying out the send stage (mailer.py) without emailing
+# anybody. Point EMAIL at it:
+#
+#   python3 mock_smtp.py --latency 0.02 --save ./mock_mail
+#   "EMAIL": {"host": "127.0.0.1", "port": 8725, "from": "instructors@example.edu", ...}
+#
+# it speaks just enough SMTP for smtplib (EHLO/HELO, AUTH PLAIN with any login, MAIL, RCPT, DATA, RSET, NOOP, QUIT),
+# takes every message it's given and throws it away, or saves it as a .eml file with --save. For seeing how the sender
+# copes with a real server's moods:
+#   --latency        seconds before every message is accepted (plus up to --jitter more)
+#   --fail-rate      fraction of recipients turned away with a 451 "try again later"
+#   --reject-rate    fraction of recipients turned away for good with a 550
+#   --hang-up-after  drops every connection after that many messages, like servers that limit messages per connection
+#
+# when it's stopped it prints how many connections and messages it got, which is also in server.mock.stats for tests.
+
+# how many messages to keep around in memory for tests (the counts in stats keep going past it)
+KEEP_MESSAGES = 10000
+
+
+class MockSmtp:
+
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0, reject_rate=0.0, hang_up_after=0, save=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.reject_rate = reject_rate
+        self.hang_up_after = hang_up_after
+        self.save = save
+        self.stats = {"connections":0, "messages":0, "recipients":0, "deferred":0, "rejected":0, "hang_ups":0,
+                      "bytes":0}
+        # (from, [to], message bytes) for every message taken, oldest first
+        self.messages = []
+        self.lock = threading.Lock()
+        self.random = random.Random()
+
+    def count(self, field, amount=1) -> None:
+        with self.lock:
+            self.stats[field] += amount
+
+    # what happens to one recipient: None to take it, or the reply to turn it away with
+    def refuse(self):
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.reject_rate:
+            self.count("rejected")
+            return "550 5.1.1 Mailbox unavailable"
+        if roll < self.reject_rate + self.fail_rate:
+            self.count("deferred")
+            return "451 4.7.1 Try again later"
+        return None
+
+    def deliver(self, sender, recipients, data) -> None:
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        with self.lock:
+            self.stats["messages"] += 1
+            self.stats["recipients"] += len(recipients)
+            self.stats["bytes"] += len(data)
+            number = self.stats["messages"]
+            self.messages.append((sender, recipients, data))
+            if len(self.messages) > KEEP_MESSAGES:
+                del self.messages[0]
+        if self.save is not None:
+            os.makedirs(self.save, exist_ok=True)
+            with open(os.path.join(self.save, f"{number:06d}.eml"), "wb") as file:
+                file.write(data)
+
+
+class MockSmtpHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line) -> None:
+        self.wfile.write(line.encode()+b"\r\n")
+
+    def handle(self):
+        mock = self.server.mock
+        mock.count("connections")
+        self.reply("220 mock-smtp ESMTP ready")
+        sender, recipients, taken = None, [], 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode(errors="replace").strip().partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self.wfile.write(b"250-mock-smtp\r\n250-8BITMIME\r\n250-SMTPUTF8\r\n250 AUTH PLAIN\r\n")
+            elif command == "HELO":
+                self.reply("250 mock-smtp")
+            elif command == "AUTH":
+                # any login works, we just check it's shaped right
+                parts = argument.split()
+                try:
+                    base64.b64decode(parts[1] if len(parts) > 1 else "", validate=True)
+                    self.reply("235 2.7.0 Authentication successful")
+                except ValueError:
+                    self.reply("501 5.5.2 Can't decode that")
+            elif command == "MAIL":
+                sender, recipients = argument.partition(":")[2].strip(), []
+                self.reply("250 2.1.0 OK")
+            elif command == "RCPT":
+                if sender is None:
+                    self.reply("503 5.5.1 MAIL first")
+                    continue
+                refusal = mock.refuse()
+                if refusal is not None:
+                    self.reply(refusal)
+                else:
+                    recipients.append(argument.partition(":")[2].strip())
+                    self.reply("250 2.1.5 OK")
+            elif command == "DATA":
+                if recipients == []:
+                    self.reply("554 5.5.1 No valid recipients")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in [b".\r\n", b".\n"]:
+                        break
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+                mock.deliver(sender, recipients, b"".join(lines))
+                taken += 1
+                sender, recipients = None, []
+                self.reply("250 2.0.0 Queued")
+                if mock.hang_up_after and taken >= mock.hang_up_after:
+                    mock.count("hang_ups")
+                    self.reply("421 4.7.0 Too many messages on one connection, closing")
+                    return
+            elif command == "RSET":
+                sender, recipients = None, []
+                self.reply("250 2.0.0 OK")
+            elif command == "NOOP":
+                self.reply("250 2.0.0 OK")
+            elif command == "QUIT":
+                self.reply("221 2.0.0 Bye")
+                return
+            else:
+                self.reply("502 5.5.2 Command not recognized")
+
+
+class MockSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start(port=8725, host="127.0.0.1", **settings):
+    server = MockSmtpServer((host, port), MockSmtpHandler)
+    server.mock = MockSmtp(**settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A local stand-in mail server for trying out the send stage.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8725)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every message is accepted")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of recipients to defer with a 451")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="fraction of recipients to reject with a 550")
+    parser.add_argument("--hang-up-after", type=int, default=0, help="drop connections after this many messages")
+    parser.add_argument("--save", default=None, help="folder to save every message in as a .eml file")
+    args = parser.parse_args()
+
+    server = start(args.port, args.host, latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+                   reject_rate=args.reject_rate, hang_up_after=args.hang_up_after, save=args.save)
+    print(f"Mock SMTP server running on {args.host}:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(server.mock.stats, indent=4))
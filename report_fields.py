@@ -0,0 +1,149 @@
+import bisect
+
+# every column make_emails knows how to fill in lives here. A field is registered under the key it uses in
+# config['REPORT']['include'], and is a function that gets called once per report with:
+#   run   - everything about this report that's the same for every student (see make_emails for what's in it)
+#   style - the prefix/postfix (and child prefix/postfix) for the field from config['REPORT']['customization']
+# and hands back the function that fills in the column for one student: fill(student, missing) where student is the
+# record from students.json and missing is the sorted positions (in run["current_assignments"]) the student is
+# missing. fill returns the text for the cell, or None to leave it blank.
+#
+# anything that doesn't change from student to student should be worked out in the outer function, so the
+# per-student part is as little work as possible. Adding a new column is just registering another one of these.
+
+FIELDS = {}
+
+
+def report_field(*names):
+    def register(factory):
+        for name in names:
+            FIELDS[name] = factory
+        return factory
+    return register
+
+
+# fills in the prefix/postfix for every included field, empty strings for anything the config doesn't customize
+def compile_styles(config) -> dict:
+    customization = config['REPORT']['customization']
+    styles = {}
+    for item in config['REPORT']['include']:
+        style = {"prefix":"", "postfix":"", "child":{"prefix":"", "postfix":""}}
+        if item in customization:
+            style["prefix"] = customization[item]["prefix"]
+            style["postfix"] = customization[item]["postfix"]
+            if "child" in customization[item]:
+                style["child"]["prefix"] = customization[item]["child"]["prefix"]
+                style["child"]["postfix"] = customization[item]["child"]["postfix"]
+        styles[item] = style
+    return styles
+
+
+# turns the REPORT config into the list of (column name, fill function) make_emails runs for each student, in the
+# order the config lists them.
+def compile_columns(config, run) -> list:
+    styles = compile_styles(config)
+    columns = []
+    for item, info in config['REPORT']['include'].items():
+        if item not in FIELDS:
+            print(f"No report field called {item}, the \"{info['fieldname']}\" column will be left blank.")
+            continue
+        columns.append((info['fieldname'], FIELDS[item](run, styles[item])))
+    return columns
+
+
+# for columns that come out the same for everybody
+def constant(value):
+    return lambda student, missing: value
+
+
+@report_field("name")
+def name_field(run, style):
+    prefix, postfix = style["prefix"], style["postfix"]
+    # Canvas stores Last, First
+    return lambda student, missing: prefix+student["name"].split(", ")[-1]+postfix
+
+
+@report_field("email")
+def email_field(run, style):
+    prefix, postfix = style["prefix"], style["postfix"]
+    return lambda student, missing: prefix+student["email"]+postfix
+
+
+@report_field("section")
+def section_field(run, style):
+    prefix, postfix = style["prefix"], style["postfix"]
+    return lambda student, missing: prefix+student.get("section", "")+postfix
+
+
+@report_field("module")
+def module_field(run, style):
+    return constant(style["prefix"]+run["week_map"][run["current_week"]]["name"]+style["postfix"])
+
+
+@report_field("assignment_count")
+def assignment_count_field(run, style):
+    return constant(style["prefix"]+str(len(run["week_map"][run["current_week"]]["assignments"]))+style["postfix"])
+
+
+@report_field("assignment_list")
+def assignment_list_field(run, style):
+    assignment_list = ""
+    for assignment in run["week_map"][run["current_week"]]["assignments"]:
+        assignment_list += style["child"]["prefix"]+assignment+style["child"]["postfix"]
+    return constant(style["prefix"]+assignment_list+style["postfix"])
+
+
+# older configs call this one total_course
+@report_field("total_course_assignments", "total_course")
+def total_course_assignments_field(run, style):
+    total_course_assignments = 0
+    for week in run["weeks"]:
+        total_course_assignments += len(run["week_map"][week]["assignments"])
+    return constant(style["prefix"]+str(total_course_assignments)+style["postfix"])
+
+
+# the number of assignments that have been due so far
+@report_field("total_complete")
+def total_complete_field(run, style):
+    return constant(style["prefix"]+str(len(run["current_assignments"]))+style["postfix"])
+
+
+# for the module, start at the max that can be done and take off everything missing from it
+@report_field("module_completed")
+def module_completed_field(run, style):
+    prefix, postfix = style["prefix"], style["postfix"]
+    assignment_count = len(run["week_map"][run["current_week"]]["assignments"])
+    module_start = run["module_start"]
+
+    def fill(student, missing):
+        return prefix+str(assignment_count - (len(missing) - bisect.bisect_left(missing, module_start)))+postfix
+    return fill
+
+
+# same thing, but over everything that's been due in the course so far
+@report_field("actual_completed")
+def actual_completed_field(run, style):
+    prefix, postfix = style["prefix"], style["postfix"]
+    total_complete = len(run["current_assignments"])
+    return lambda student, missing: prefix+str(total_complete - len(missing))+postfix
+
+
+# the names of everything the student is missing (that's allowed on the late list), so they know what to work on.
+# left blank for students who are all caught up.
+@report_field("late_assignment_list")
+def late_assignment_list_field(run, style):
+    prefix, postfix = style["prefix"], style["postfix"]
+    # work out each assignment's line once, or None if it's kept off the list
+    lines = []
+    for assignment in run["current_assignments"]:
+        if run["assignment_dict"][assignment]["showonlatelist"] != "False":
+            lines.append(style["child"]["prefix"]+assignment+style["child"]["postfix"])
+        else:
+            lines.append(None)
+
+    def fill(student, missing):
+        late_assignment_list = "".join(lines[position] for position in missing if lines[position] is not None)
+        if late_assignment_list == "":
+            return None
+        return prefix+late_assignment_list+postfix
+    return fill
@@ -0,0 +1,268 @@
+import copy
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+# an optional SQLite home for the userdata (turned on with STORAGE.backend = "sqlite" in config.json). It looks the
+# same as the JSON store from the outside (read/checkout/write/exists/set_field), so funcs doesn't care which one it's
+# using.
+#
+# each file gets its own table, one row per entry, so changing one assignment doesn't mean rewriting every assignment.
+# write() compares against what's saved and only touches the rows that actually changed, and set_field() flips a single
+# value in place (like showonlatelist). Rows keep their position, so everything comes back out in the same order it
+# went in (module order matters).
+#
+#   students            one row per student, indexed by Canvas user id
+#   assignments         one row per assignment, indexed by Canvas assignment id
+#   modules             one row per module (without its assignment list)
+#   module_assignments  which assignments are in which module, in order, indexed both ways
+#   api_assignments     the assignments api.json has pulled
+#   missing             who's missing each of them, indexed by assignment and by student
+#   documents           anything else (sync_state, ...) stored whole
+#
+# config.json always stays a JSON file, since that's where the backend gets picked. The first time a file is asked for,
+# it gets copied in from the matching JSON file if there is one. Hand edits to modules.json after that need to be
+# brought over with `python sqlite_store.py import modules` (and `export` writes the JSON back out).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS students (key TEXT PRIMARY KEY, pos INTEGER NOT NULL, user_id INTEGER, data TEXT);
+CREATE INDEX IF NOT EXISTS students_user_id ON students (user_id);
+CREATE TABLE IF NOT EXISTS assignments (key TEXT PRIMARY KEY, pos INTEGER NOT NULL, assignment_id INTEGER,
+                                        showonlatelist TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS assignments_assignment_id ON assignments (assignment_id);
+CREATE TABLE IF NOT EXISTS modules (key TEXT PRIMARY KEY, pos INTEGER NOT NULL, module_id INTEGER, data TEXT);
+CREATE TABLE IF NOT EXISTS module_assignments (parent TEXT NOT NULL, pos INTEGER NOT NULL, item TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS module_assignments_parent ON module_assignments (parent, pos);
+CREATE INDEX IF NOT EXISTS module_assignments_item ON module_assignments (item);
+CREATE TABLE IF NOT EXISTS api_assignments (key TEXT PRIMARY KEY, pos INTEGER NOT NULL, data TEXT);
+CREATE TABLE IF NOT EXISTS missing (parent TEXT NOT NULL, pos INTEGER NOT NULL, item INTEGER);
+CREATE INDEX IF NOT EXISTS missing_parent ON missing (parent, pos);
+CREATE INDEX IF NOT EXISTS missing_item ON missing (item);
+CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+"""
+
+# the files that get their own tables:
+#   table    - one row per entry
+#   columns  - values pulled out of each entry into their own (indexed) columns, column: field
+#   children - the table a list gets split out into, and which list: a field of the entry, or None for the entry itself
+TABLES = {
+    "students": {"table":"students", "columns":{"user_id":"id"}},
+    "assignments": {"table":"assignments", "columns":{"assignment_id":"id", "showonlatelist":"showonlatelist"}},
+    "modules": {"table":"modules", "columns":{"module_id":"id"}, "children":("module_assignments", "assignments")},
+    "api": {"table":"api_assignments", "columns":{}, "children":("missing", None)},
+}
+
+
+class SqliteStore:
+
+    def __init__(self, path="./userdata/userdata.sqlite", json_directory="./userdata"):
+        self.path = os.path.abspath(path)
+        self.json_directory = os.path.abspath(json_directory)
+        self.local = threading.local()
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    # sqlite connections can't be shared between threads, so each thread gets its own
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    # bumped on every write, so a cached copy is good as long as the version hasn't moved (even if another process
+    # did the writing)
+    def version(self, name):
+        row = self.connection().execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def exists(self, name) -> bool:
+        return self.version(name) is not None or os.path.exists(self.json_path(name))
+
+    def read(self, name, default=None):
+        version = self.version(name)
+        if version is None:
+            if not os.path.exists(self.json_path(name)):
+                if default is not None:
+                    return default
+                raise FileNotFoundError(f"No {name} saved in {self.path} (or {self.json_path(name)})")
+            self.import_json(name)
+            version = self.version(name)
+
+        with self.lock:
+            cached = self.cache.get(name)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        data = self.load(name)
+        with self.lock:
+            self.cache[name] = (version, data)
+        return data
+
+    def checkout(self, name, default=None):
+        data = self.read(name, default)
+        if self.version(name) is None:
+            return copy.deepcopy(data)
+        # rebuilding from the tables already gives us a fresh copy
+        return self.load(name)
+
+    # changes whenever the saved data does (None if there isn't any), for anything caching what it built from the data
+    def fingerprint(self, name):
+        version = self.version(name)
+        if version is not None:
+            return (self.path, version)
+        if os.path.exists(self.json_path(name)):
+            stat = os.stat(self.json_path(name))
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        return None
+
+    # saves data, only rewriting the entries that are different from what's saved (and dropping ones that are gone)
+    def write(self, name, data) -> None:
+        old = self.read(name, {}) if self.version(name) is not None else {}
+        conn = self.connection()
+        with conn:
+            if name in TABLES:
+                self.delete_rows(conn, name, [key for key in old if key not in data])
+                changed = [key for key in data if key not in old or old[key] != data[key]]
+                positions = {key: pos for pos, key in enumerate(data)}
+                self.insert_rows(conn, name, [(key, positions[key], data[key]) for key in changed])
+                # anything that kept its value but whose position is different now (it moved, or something was added or
+                # dropped ahead of it) just gets its position updated
+                saved = dict(conn.execute(f"SELECT key, pos FROM {TABLES[name]['table']}"))
+                moved = [(positions[key], key) for key in data if saved.get(key) != positions[key]]
+                conn.executemany(f"UPDATE {TABLES[name]['table']} SET pos = ? WHERE key = ?", moved)
+            else:
+                conn.execute("INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)", (name, json.dumps(data)))
+            version = self.bump(conn, name)
+        with self.lock:
+            self.cache[name] = (version, data)
+
+    # changes one value of one entry (like an assignment's showonlatelist) without touching anything else
+    def set_field(self, name, key, field, value) -> None:
+        self.set_fields(name, [(key, field, value)])
+
+    # the same for a bunch of (key, field, value) at once, as single row updates in one transaction
+    def set_fields(self, name, changes) -> None:
+        spec = TABLES.get(name)
+        if spec is None or (spec.get("children") is not None and
+                            any(spec["children"][1] in [None, field] for key, field, value in changes)):
+            data = self.checkout(name)
+            for key, field, value in changes:
+                data[key][field] = value
+            self.write(name, data)
+            return
+        conn = self.connection()
+        with conn:
+            for key, field, value in changes:
+                sets = "data = json_set(data, ?, json(?))"
+                params = ["$."+json.dumps(field), json.dumps(value)]
+                for column, source in spec["columns"].items():
+                    if source == field:
+                        sets += f", {column} = ?"
+                        params.append(value)
+                cursor = conn.execute(f"UPDATE {spec['table']} SET {sets} WHERE key = ?", params+[key])
+                if cursor.rowcount == 0:
+                    raise KeyError(key)
+            self.bump(conn, name)
+
+    def forget(self, name=None) -> None:
+        with self.lock:
+            if name is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(name, None)
+
+    def bump(self, conn, name):
+        conn.execute("INSERT INTO versions (name, version) VALUES (?, 1) "
+                     "ON CONFLICT(name) DO UPDATE SET version = version + 1", (name,))
+        return conn.execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()[0]
+
+    def delete_rows(self, conn, name, keys) -> None:
+        spec = TABLES[name]
+        keys = [(key,) for key in keys]
+        conn.executemany(f"DELETE FROM {spec['table']} WHERE key = ?", keys)
+        if spec.get("children") is not None:
+            conn.executemany(f"DELETE FROM {spec['children'][0]} WHERE parent = ?", keys)
+
+    def insert_rows(self, conn, name, rows) -> None:
+        spec = TABLES[name]
+        self.delete_rows(conn, name, [key for key, pos, value in rows])
+        columns = ["key", "pos"] + list(spec["columns"]) + ["data"]
+        values = []
+        children = []
+        for key, pos, value in rows:
+            if spec.get("children") is not None:
+                field = spec["children"][1]
+                items = value if field is None else value.get(field, [])
+                children += [(key, index, item) for index, item in enumerate(items)]
+                value = None if field is None else {item: value[item] for item in value if item != field}
+            values.append([key, pos] + [(value or {}).get(source) for source in spec["columns"].values()]
+                          + [json.dumps(value) if value is not None else None])
+        conn.executemany(f"INSERT INTO {spec['table']} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                         values)
+        if children != []:
+            conn.executemany(f"INSERT INTO {spec['children'][0]} (parent, pos, item) VALUES (?, ?, ?)", children)
+
+    # puts the file back together from its table(s), in the order it was saved
+    def load(self, name) -> dict:
+        conn = self.connection()
+        spec = TABLES.get(name)
+        if spec is None:
+            row = conn.execute("SELECT data FROM documents WHERE name = ?", (name,)).fetchone()
+            return {} if row is None else json.loads(row[0])
+
+        data = {}
+        for key, value in conn.execute(f"SELECT key, data FROM {spec['table']} ORDER BY pos"):
+            data[key] = json.loads(value) if value is not None else None
+        if spec.get("children") is not None:
+            table, field = spec["children"]
+            lists = {key: [] for key in data}
+            for parent, item in conn.execute(f"SELECT parent, item FROM {table} ORDER BY parent, pos"):
+                lists[parent].append(item)
+            for key in data:
+                if field is None:
+                    data[key] = lists[key]
+                else:
+                    data[key][field] = lists[key]
+        return data
+
+    def json_path(self, name) -> str:
+        return os.path.join(self.json_directory, name+".json")
+
+    # (re)loads a JSON file into the database, replacing whatever was there
+    def import_json(self, name) -> None:
+        with open(self.json_path(name), "r") as file:
+            data = json.load(file)
+        conn = self.connection()
+        with conn:
+            if name in TABLES:
+                conn.execute(f"DELETE FROM {TABLES[name]['table']}")
+                if TABLES[name].get("children") is not None:
+                    conn.execute(f"DELETE FROM {TABLES[name]['children'][0]}")
+            conn.execute("DELETE FROM versions WHERE name = ?", (name,))
+        self.forget(name)
+        self.write(name, data)
+
+    def export_json(self, name) -> None:
+        with open(self.json_path(name), "w") as file:
+            json.dump(self.read(name), file, indent=4)
+
+
+if __name__ == "__main__":
+    # python sqlite_store.py import modules   -> copy ./userdata/modules.json into the database
+    # python sqlite_store.py export modules   -> write the database's copy back out to ./userdata/modules.json
+    if len(sys.argv) != 3 or sys.argv[1] not in ["import", "export"]:
+        print("usage: python sqlite_store.py import|export <students|assignments|modules|api|sync_state>")
+        sys.exit(1)
+    abspath = os.path.abspath(__file__)
+    os.chdir(os.path.dirname(abspath))
+    store = SqliteStore()
+    if sys.argv[1] == "import":
+        store.import_json(sys.argv[2])
+    else:
+        store.export_json(sys.argv[2])
@@ -0,0 +1,222 @@
+import contextlib
+import functools
+import json
+import math
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+# keeps track of what a Canvas sync actually spent its time on: how many requests went to each endpoint, how long they
+# took, how much came back, and how often Canvas made us wait. Lets us tell whether a slow pull is Canvas throttling
+# us or our own code.
+#
+# anything that wants numbers opens a tracker with `with track("name", progress=callback) as metrics:` and every
+# Canvas request made while it's open gets counted in it. The sync functions in funcs are wrapped
+# with @tracked, which does that and saves a summary to ./userdata/metrics/ when they finish. Trackers can be nested
+# (the Streamlit jobs open one around the whole job), and every open one sees every request. Trackers belong to the
+# thread that opened them (and the thread pools it starts), so two syncs running side by side keep separate numbers.
+#
+# progress is counted in requests. Whoever knows how many requests are coming says so with plan() (Canvas tells us the
+# page count up front for some lists, others only reveal the next page as we go), and every finished request counts
+# one. progress(done, total, label) gets called after each.
+
+# how many summaries to keep around in ./userdata/metrics
+KEEP_SUMMARIES = 50
+
+local = threading.local()
+
+
+class SyncMetrics:
+
+    def __init__(self, name, progress=None):
+        self.name = name
+        self.progress = progress
+        self.started = time.time()
+        self.finished = None
+        self.endpoints = {}
+        self.planned = 0
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def endpoint(self, url) -> dict:
+        name = endpoint_name(url)
+        if name not in self.endpoints:
+            self.endpoints[name] = {"requests":0, "bytes":0, "latencies":[], "retries":0, "throttled":0,
+                                    "not_modified":0, "errors":0, "waited":0.0}
+        return self.endpoints[name]
+
+    # one request going out and coming back (or failing to). waited is how long the rate limiter held it first.
+    def request(self, url, seconds, status, size, waited) -> None:
+        with self.lock:
+            endpoint = self.endpoint(url)
+            endpoint["requests"] += 1
+            endpoint["bytes"] += size
+            endpoint["latencies"].append(seconds)
+            endpoint["waited"] += waited
+            if status is None or status >= 400:
+                endpoint["errors"] += 1
+            if status == 304:
+                endpoint["not_modified"] += 1
+
+    # the body of a streamed response, read after request() was called for it
+    def received(self, url, size) -> None:
+        with self.lock:
+            self.endpoint(url)["bytes"] += size
+
+    # a request that's going to be tried again (the backoff shows up in the retry's waited time)
+    def retry(self, url, throttled) -> None:
+        with self.lock:
+            endpoint = self.endpoint(url)
+            endpoint["retries"] += 1
+            if throttled:
+                endpoint["throttled"] += 1
+
+    def plan(self, requests) -> None:
+        with self.lock:
+            self.planned += requests
+        self.report(None)
+
+    # a request finished for good (not counting retries)
+    def advance(self, label) -> None:
+        with self.lock:
+            self.done += 1
+        self.report(label)
+
+    def report(self, label) -> None:
+        if self.progress is not None:
+            with self.lock:
+                done, total = self.done, max(self.planned, self.done)
+            self.progress(done, total, label)
+
+    def summary(self) -> dict:
+        with self.lock:
+            finished = self.finished if self.finished is not None else time.time()
+            endpoints = {}
+            totals = {"requests":0, "bytes":0, "retries":0, "throttled":0, "not_modified":0, "errors":0,
+                      "request_seconds":0.0, "waited_seconds":0.0}
+            for name, endpoint in sorted(self.endpoints.items()):
+                latencies = sorted(endpoint["latencies"])
+                endpoints[name] = {"requests":endpoint["requests"], "bytes":endpoint["bytes"],
+                                   "retries":endpoint["retries"], "throttled":endpoint["throttled"],
+                                   "not_modified":endpoint["not_modified"], "errors":endpoint["errors"],
+                                   "waited_seconds":round(endpoint["waited"], 4),
+                                   "latency":{"mean":round(sum(latencies)/len(latencies), 4) if latencies else None,
+                                              "p50":percentile(latencies, 50), "p90":percentile(latencies, 90),
+                                              "p99":percentile(latencies, 99), "max":latencies[-1] if latencies else None}}
+                for key in ["requests", "bytes", "retries", "throttled", "not_modified", "errors"]:
+                    totals[key] += endpoint[key]
+                totals["request_seconds"] += sum(latencies)
+                totals["waited_seconds"] += endpoint["waited"]
+        wall = finished - self.started
+        totals["request_seconds"] = round(totals["request_seconds"], 4)
+        totals["waited_seconds"] = round(totals["waited_seconds"], 4)
+        return {"name":self.name, "started":time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "wall_seconds":round(wall, 4), "totals":totals, "endpoints":endpoints}
+
+    # the one line version, for the end of a sync
+    def describe(self) -> str:
+        summary = self.summary()
+        totals = summary["totals"]
+        latencies = sorted(latency for endpoint in self.endpoints.values() for latency in endpoint["latencies"])
+        text = (f"{self.name} took {summary['wall_seconds']:.1f}s: {totals['requests']} requests, "
+                f"{totals['bytes']/1024/1024:.2f} MB")
+        if latencies:
+            text += f", {percentile(latencies, 50)*1000:.0f}ms median / {percentile(latencies, 90)*1000:.0f}ms p90"
+        if totals["retries"]:
+            text += f", {totals['retries']} retried ({totals['throttled']} throttled)"
+        if totals["waited_seconds"] >= 0.05:
+            text += f", {totals['waited_seconds']:.1f}s held back by the rate limit (added up over every thread)"
+        return text+"."
+
+    def save(self, directory="./userdata/metrics") -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))+f"-{self.name}.json")
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=4)
+        # only keep the latest few around
+        saved = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+        for name in saved[:-KEEP_SUMMARIES]:
+            os.remove(os.path.join(directory, name))
+        return path
+
+
+@contextlib.contextmanager
+def track(name, progress=None):
+    metrics = SyncMetrics(name, progress)
+    outer = current()
+    local.trackers = outer + [metrics]
+    try:
+        yield metrics
+    finally:
+        metrics.finished = time.time()
+        local.trackers = outer
+
+
+# wraps a sync function so every run gets tracked, summed up in a line, and saved to ./userdata/metrics
+def tracked(name):
+    def wrap(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            with track(name) as metrics:
+                result = func(*args, **kwargs)
+            print(metrics.describe())
+            try:
+                metrics.save()
+            except OSError as e:
+                print(f"Couldn't save the sync summary: {e}")
+            return result
+        return run
+    return wrap
+
+
+# the trackers open on this thread. Worker threads don't have any of their own, so whoever starts them hands theirs
+# over with adopt() (funcs.request_pool does this for its thread pools).
+def current() -> list:
+    return list(getattr(local, "trackers", []))
+
+
+def adopt(trackers) -> None:
+    local.trackers = list(trackers)
+
+
+# the hooks the Canvas client (and anything planning requests) call. They go to every tracker open on this thread.
+def request(url, seconds, status, size, waited) -> None:
+    for metrics in current():
+        metrics.request(url, seconds, status, size, waited)
+
+
+def received(url, size) -> None:
+    for metrics in current():
+        metrics.received(url, size)
+
+
+def retry(url, throttled) -> None:
+    for metrics in current():
+        metrics.retry(url, throttled)
+
+
+def plan(requests) -> None:
+    for metrics in current():
+        metrics.plan(requests)
+
+
+def advance(label) -> None:
+    for metrics in current():
+        metrics.advance(label)
+
+
+# groups urls by what they ask for: ".../courses/123/assignments/456/submissions?page=2" -> "courses/:id/assignments/:id/submissions"
+def endpoint_name(url) -> str:
+    path = urlparse(url).path
+    path = re.sub(r"^.*?/api/v1/", "", path).strip("/")
+    return re.sub(r"(^|/)[0-9]+(?=/|$)", r"\1:id", path)
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    # nearest rank
+    index = max(0, min(len(values)-1, math.ceil(percent/100*len(values))-1))
+    return round(values[index], 4)
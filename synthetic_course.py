@@ -0,0 +1,134 @@
+import datetime
+import random
+
+import funcs
+
+# makes up a Canvas course of whatever size we want, so we can see how the tool holds up on courses much bigger than
+# the ones we have on hand (see benchmark.py). Everything comes out in the same shape Canvas hands it to us
+# (enrollments, sections, assignments, modules, submissions), and write_userdata() turns it into a filled in
+# ./userdata folder by running it through the same functions a real pull does.
+#
+# the same seed always gives the same course. Submissions are made one assignment at a time when asked for, since a
+# big course has millions of them.
+
+START = datetime.datetime(2025, 1, 6, 23, 59, tzinfo=datetime.timezone.utc)
+
+
+def make_course(students=1000, assignments=60, modules=12, missing_rate=0.15, seed=0, section_size=40) -> dict:
+    rnd = random.Random(seed)
+
+    sections = [{"id":5000+index, "name":f"Section {index+1:03d}"} for index in range(max(1, -(-students // section_size)))]
+
+    enrollments = []
+    for index in range(students):
+        user = {"id":100000+index, "login_id":f"student{index}", "sortable_name":f"Last{index}, First{index}"}
+        enrollments.append({"role":"StudentEnrollment", "course_section_id":sections[index % len(sections)]["id"], "user":user})
+        # a few students are in a second section (lab + lecture)
+        if rnd.random() < 0.02 and len(sections) > 1:
+            enrollments.append({"role":"StudentEnrollment", "course_section_id":sections[(index+1) % len(sections)]["id"], "user":user})
+
+    # assignments come due a module (week) at a time, with a few in no module at all
+    per_module = max(1, assignments // modules)
+    assignment_list = []
+    module_assignments = {}
+    module_list = []
+    for index in range(assignments):
+        week = min(index // per_module, modules-1)
+        due = START + datetime.timedelta(days=7*week, hours=-rnd.randrange(0, 72))
+        submission_types = ["external_tool"] if rnd.random() < 0.1 else ["online_upload"]
+        name = f"Week {week+1} Assignment {index+1} ({index+1})"
+        assignment = {"id":200000+index, "name":name, "submission_types":submission_types,
+                      "due_at":due.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        # some are quizzes or graded discussions, which modules list by their quiz/topic id instead of the assignment's.
+        # picked off the index (not rnd) so a seed still makes the same course it always has.
+        if submission_types != ["external_tool"] and index % 7 == 3:
+            assignment.update(submission_types=["online_quiz"], quiz_id=400000+index)
+        elif submission_types != ["external_tool"] and index % 11 == 5:
+            assignment.update(submission_types=["discussion_topic"], discussion_topic={"id":600000+index})
+        assignment_list.append(assignment)
+        if rnd.random() < 0.03:
+            continue
+        module_assignments.setdefault(f"Module {week+1}", []).append(name)
+    for week in range(modules):
+        module_list.append({"id":300000+week, "name":f"Module {week+1}"})
+        module_assignments.setdefault(f"Module {week+1}", [])
+
+    return {"seed":seed, "missing_rate":missing_rate, "sections":sections, "enrollments":enrollments,
+            "assignments":assignment_list, "modules":module_list, "module_assignments":module_assignments}
+
+
+# what a module holds, the way /modules/<id>/items lists it: a header, then its assignments, with quizzes and graded
+# discussions pointing at their quiz/topic instead of the assignment
+def module_items(course, module) -> list:
+    by_name = {assignment["name"]: assignment for assignment in course["assignments"]}
+    items = [{"id":module["id"]*10, "title":module["name"], "type":"SubHeader", "position":1}]
+    for name in course["module_assignments"][module["name"]]:
+        assignment = by_name[name]
+        if "quiz_id" in assignment:
+            kind, content_id = "Quiz", assignment["quiz_id"]
+        elif "discussion_topic" in assignment:
+            kind, content_id = "Discussion", assignment["discussion_topic"]["id"]
+        else:
+            kind, content_id = "Assignment", assignment["id"]
+        items.append({"id":assignment["id"]+500000, "title":name, "type":kind, "content_id":content_id,
+                      "position":len(items)+1})
+    return items
+
+
+# every student's submission for one assignment, the way /assignments/:id/submissions lists them.
+def make_submissions(course, assignment) -> list:
+    rnd = random.Random(course["seed"]*1000003 + assignment["id"])
+    # the graded-by-hand ones get a "0" instead of Canvas's missing flag
+    external = "external_tool" in assignment["submission_types"]
+    submissions = []
+    seen = set()
+    for enrollment in course["enrollments"]:
+        # one submission per student, even for the ones enrolled twice
+        if enrollment["user"]["id"] in seen:
+            continue
+        seen.add(enrollment["user"]["id"])
+        due = datetime.datetime.strptime(assignment["due_at"], "%Y-%m-%dT%H:%M:%SZ")
+        missing = rnd.random() < course["missing_rate"]
+        submitted_at = None
+        graded_at = None
+        if missing:
+            grade = "0" if external else None
+            state = "graded" if external else "unsubmitted"
+            if external:
+                graded_at = (due + datetime.timedelta(days=2)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        else:
+            grade = str(rnd.randrange(6, 11))
+            state = "graded"
+            submitted_at = (due - datetime.timedelta(minutes=rnd.randrange(0, 4000))).strftime("%Y-%m-%dT%H:%M:%SZ")
+            graded_at = (due + datetime.timedelta(days=2)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        submissions.append({"id":assignment["id"]*1000000 + enrollment["user"]["id"], "user_id":enrollment["user"]["id"],
+                            "assignment_id":assignment["id"], "missing":missing and not external, "grade":grade,
+                            "workflow_state":state, "submitted_at":submitted_at, "graded_at":graded_at})
+    return submissions
+
+
+# fills in a userdata folder (config, students, assignments, modules and api) for the course, with the modules mapped
+# like someone already went through change_late_list. Uses the store, so this writes to whichever userdata folder the
+# store is pointed at (the one under the current directory).
+def write_userdata(course) -> None:
+    funcs.setup_data(["config", "assignments", "modules", "api", "students"])
+
+    funcs.store.write("students", funcs.students_from_enrollments(course["enrollments"], course["sections"]))
+
+    assignments = funcs.merge_assignments({}, course["assignments"])
+    for assignment in assignments.values():
+        assignment["showonlatelist"] = "True"
+    funcs.store.write("assignments", assignments)
+
+    modules = {}
+    for module in course["modules"]:
+        modules[module["name"]] = {"id":module["id"], "name":module["name"],
+                                   "assignments":list(course["module_assignments"][module["name"]])}
+    funcs.store.write("modules", funcs.merge_modules(modules, course["modules"], list(assignments.keys())))
+
+    api = {}
+    for assignment in course["assignments"]:
+        api[assignment["name"]] = funcs.missing_from_submissions(make_submissions(course, assignment),
+                                                                 assignments[assignment["name"]]["missingif"])
+    funcs.store.write("api", api)
+
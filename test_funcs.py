@@ -0,0 +1,13 @@
+import funcs
+
+
+def test_report_names(monkeypatch):
+    modules = {"1": {"name":"Module 01: Unit 1", "assignments":[]},
+               "2": {"name":"Module 01: Unit 2", "assignments":[]},
+               "3": {"name":"Module 02: Intro", "assignments":[]},
+               "4": {"name":"Module 03", "assignments":[]},
+               "Homeless Assignments": {"assignments":[]}}
+    monkeypatch.setattr(funcs, "get_week_data", lambda: modules)
+    names = [funcs.report_name(modules[key]) for key in ["1", "2", "3", "4"]]
+    assert names == ["Module 01 - Unit 1", "Module 01 - Unit 2", "Module 02", "Module 03"]
+    assert funcs.export_path(modules["3"]) == "exports/Report - Module 02.csv"
@@ -0,0 +1,19 @@
+import glob
+import json
+
+import gradebook
+
+
+def test_example_export():
+    with open("examples/assignments.json", "r") as file:
+        assignments = json.load(file)
+    missing, students = gradebook.read_missing(glob.glob("examples/*_Grades-*.csv")[0], assignments)
+    assert students == 1
+    assert len(missing) == 25
+    # the example config is "missingif": 0, and the test student has 0.00 on a bunch of them
+    assert missing["Module 02 - Unit 1: Knowledge Check (2431102)"] == [378704]
+    assert sum(1 for users in missing.values() if users == [378704]) == 4
+
+
+def test_grade_text():
+    assert [gradebook.grade_text(value) for value in [0, "0.00", "8.50", "10.00", "F", 7.5]] == ["0", "0", "8.5", "10", "F", "7.5"]
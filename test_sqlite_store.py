@@ -0,0 +1,50 @@
+from sqlite_store import SqliteStore
+
+# every write should come back out in the same order after the cache is gone (like a fresh process would read it)
+
+
+def round_trip(store, name, data):
+    store.write(name, data)
+    store.forget()
+    assert list(store.read(name)) == list(data)
+    assert store.read(name) == data
+    # and from a store that never saw the write at all
+    assert SqliteStore(store.path, store.json_directory).read(name) == data
+
+
+def modules(*names):
+    return {name: {"name":name, "assignments":[f"{name} Assignment"]} for name in names}
+
+
+def test_insert_in_the_middle(tmp_path):
+    store = SqliteStore(str(tmp_path / "userdata.sqlite"), str(tmp_path))
+    round_trip(store, "modules", modules("Module 7", "Module 8", "Homeless Assignments"))
+    # a new module from Canvas goes in ahead of Homeless Assignments
+    round_trip(store, "modules", modules("Module 7", "Module 8", "Module 9", "Homeless Assignments"))
+    round_trip(store, "modules", modules("Module 0", "Module 7", "Module 8", "Module 9", "Homeless Assignments"))
+
+
+def test_delete_then_insert(tmp_path):
+    store = SqliteStore(str(tmp_path / "userdata.sqlite"), str(tmp_path))
+    round_trip(store, "assignments", {f"A{index}": {"id":index, "showonlatelist":"True"} for index in range(6)})
+    round_trip(store, "assignments", {f"A{index}": {"id":index, "showonlatelist":"True"} for index in [0, 2, 4, 5]})
+    # an earlier due date sorts a new assignment in where the dropped ones used to be
+    round_trip(store, "assignments", {f"A{index}": {"id":index, "showonlatelist":"True"} for index in [0, 9, 2, 4, 5]})
+    round_trip(store, "assignments", {f"A{index}": {"id":index, "showonlatelist":"True"} for index in [5, 9, 0, 4]})
+
+
+def test_missing_lists(tmp_path):
+    store = SqliteStore(str(tmp_path / "userdata.sqlite"), str(tmp_path))
+    round_trip(store, "api", {"A1": [3, 1, 2], "A3": []})
+    round_trip(store, "api", {"A1": [3, 1], "A2": [7], "A3": [5, 4]})
+    round_trip(store, "api", {"A2": [7], "A3": [5, 4]})
+
+
+def test_set_fields(tmp_path):
+    store = SqliteStore(str(tmp_path / "userdata.sqlite"), str(tmp_path))
+    assignments = {f"A{index}": {"id":index, "showonlatelist":"True"} for index in range(4)}
+    store.write("assignments", assignments)
+    store.set_fields("assignments", [("A1", "showonlatelist", "False"), ("A3", "showonlatelist", "False")])
+    store.forget()
+    assert [value["showonlatelist"] for value in store.read("assignments").values()] == ["True", "False", "True", "False"]
+    assert list(store.read("assignments")) == list(assignments)
@@ -0,0 +1,151 @@
+import copy
+import json
+import os
+import threading
+
+import atomic
+
+# keeps the parsed userdata files around between calls. Every get_* helper in funcs used to open and json.load its file
+# each time it was called, and a single make_emails run reads modules.json a few times over. The store loads a file
+# once and hands back the parsed copy until the file on disk changes (different mtime, size or inode), so edits made
+# by hand in between runs are still picked up. Writes go through the store too, so it never has to re-read what it
+# just saved.
+#
+# what read() hands back is shared with every other caller, so treat it as read-only. Anything that wants to change
+# the data and save it should checkout() a private copy and write() it back (or set_field()/set_fields() for single values).
+#
+# config.json can also move everything but itself into SQLite (STORAGE.backend = "sqlite", see sqlite_store.py).
+# funcs only ever talks to `store` at the bottom, which sends each call to whichever one the config picks.
+
+
+class UserdataStore:
+
+    def __init__(self, directory="./userdata"):
+        self.directory = directory
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    # names are the file names without .json ("modules", "assignments", ...). The path is made absolute so that a
+    # process which changes directories (like the batch runner does per course) never gets another course's data.
+    def path(self, name) -> str:
+        return os.path.abspath(os.path.join(self.directory, name+".json"))
+
+    def exists(self, name) -> bool:
+        return os.path.exists(self.path(name))
+
+    def read(self, name, default=None):
+        path = self.path(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if default is not None:
+                return default
+            raise
+        fingerprint = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        with self.lock:
+            cached = self.cache.get(path)
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1]
+
+        with open(path, "r") as file:
+            data = json.load(file)
+        with self.lock:
+            self.cache[path] = (fingerprint, data)
+        return data
+
+    # a private copy that's safe to change before handing it to write()
+    def checkout(self, name, default=None):
+        return copy.deepcopy(self.read(name, default))
+
+    # changes whenever the saved data does (None if there isn't any), for anything caching what it built from the data
+    def fingerprint(self, name):
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    # saves the data (same pretty-printed layout as always) and keeps it as the cached copy. Don't change data after
+    # handing it over; checkout() again instead.
+    def write(self, name, data) -> None:
+        path = self.path(name)
+        # swapping the file in means a crash mid-write can't leave half a file behind
+        with atomic.open_file(path) as file:
+            json.dump(data, file, indent=4)
+
+        stat = os.stat(path)
+        with self.lock:
+            self.cache[path] = ((stat.st_mtime_ns, stat.st_size, stat.st_ino), data)
+
+    # changes one value of one entry (data[key][field]) and saves it
+    def set_field(self, name, key, field, value) -> None:
+        self.set_fields(name, [(key, field, value)])
+
+    # the same for a bunch of (key, field, value) at once, saved in one write
+    def set_fields(self, name, changes) -> None:
+        data = self.checkout(name)
+        for key, field, value in changes:
+            data[key][field] = value
+        self.write(name, data)
+
+    def forget(self, name=None) -> None:
+        with self.lock:
+            if name is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(self.path(name), None)
+
+
+# hands every call to the JSON store or an SQLite one, depending on config.json's STORAGE section. The config is
+# always JSON, and the SQLite stores are kept per database file (the batch runner moves between course folders).
+class StoreSwitch:
+
+    def __init__(self, json_store):
+        self.json_store = json_store
+        self.sqlite_stores = {}
+        self.lock = threading.Lock()
+
+    def backend(self, name):
+        if name == "config":
+            return self.json_store
+        storage = self.json_store.read("config", {}).get("STORAGE", {})
+        if storage.get("backend", "json") != "sqlite":
+            return self.json_store
+        path = os.path.abspath(storage.get("path", os.path.join(self.json_store.directory, "userdata.sqlite")))
+        with self.lock:
+            if path not in self.sqlite_stores:
+                # only loaded for the courses that use it
+                import sqlite_store
+                self.sqlite_stores[path] = sqlite_store.SqliteStore(path, os.path.dirname(self.json_store.path("config")))
+            return self.sqlite_stores[path]
+
+    def exists(self, name) -> bool:
+        return self.backend(name).exists(name)
+
+    def read(self, name, default=None):
+        return self.backend(name).read(name, default)
+
+    def checkout(self, name, default=None):
+        return self.backend(name).checkout(name, default)
+
+    def write(self, name, data) -> None:
+        self.backend(name).write(name, data)
+
+    def fingerprint(self, name):
+        return self.backend(name).fingerprint(name)
+
+    def set_field(self, name, key, field, value) -> None:
+        self.backend(name).set_field(name, key, field, value)
+
+    def set_fields(self, name, changes) -> None:
+        self.backend(name).set_fields(name, changes)
+
+    def forget(self, name=None) -> None:
+        self.json_store.forget(name)
+        with self.lock:
+            for sqlite in self.sqlite_stores.values():
+                sqlite.forget(name)
+
+
+store = StoreSwitch(UserdataStore())